@@ -13,21 +13,32 @@
 # Boston, MA 02111-1307, USA.
 
 import os
+import time
+# Time-to-first-frame is measured from here, so it includes the imports.
+START_TIME = time.perf_counter()
+import threading
 import gi
 gi.require_version('Gtk', '3.0')
 gi.require_version('PangoCairo', '1.0')
-from gi.repository import Gtk, Gdk, GObject, GdkPixbuf
+from gi.repository import Gtk, Gdk, GObject, GLib
+from gi.repository import Pango, PangoCairo
+import cairo
 import sugar3
 from sugar3.activity import activity
-from sugar3 import profile
 from sugar3.graphics.toolbarbox import ToolbarBox
-from sugar3.bundle.activitybundle import ActivityBundle
 from sugar3.activity.widgets import ActivityToolbarButton
 from sugar3.activity.widgets import StopButton
 from sugar3.graphics.toolbarbox import ToolbarButton
 
-from toolbar_utils import button_factory, separator_factory, label_factory
-from sprites import Sprites, Sprite
+from toolbar_utils import button_factory, separator_factory, label_factory, \
+    radio_factory
+from sprites import Sprites, Sprite, SpritePool, Atlas, ScaledImage
+from bone_renderer import BONE_WIDTH, BONE_HEIGHT, bone_factory, \
+    cairo_bone_factory, svg_str_to_pixbuf, load_svg_from_file
+from bone_cache import BoneCache, BoneImageCache
+from lattice import Lattice
+from napier import to_string, Products
+from profiler import Profiler, profiled
 
 from gettext import gettext as _
 
@@ -37,112 +48,69 @@ GRID_CELL_SIZE = style.GRID_CELL_SIZE
 SERVICE = 'org.sugarlabs.NapierActivity'
 IFACE = SERVICE
 PATH = '/org/augarlabs/NapierActivity'
-BONE_WIDTH = 101
-BONE_HEIGHT = 901
-
-
-def _svg_header(scale=1.0):
-    ''' Return standard header for SVG bones '''
-    return '<?xml version="1.0" encoding="UTF-8" standalone="no"?>\
-<!-- Created with Emacs (http://gnu.org/) -->\
-<svg\
-   xmlns:dc="http://purl.org/dc/elements/1.1/"\
-   xmlns:cc="http://creativecommons.org/ns#"\
-   xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"\
-   xmlns:svg="http://www.w3.org/2000/svg"\
-   xmlns="http://www.w3.org/2000/svg"\
-   version="1.1"\
-   width="%f"\
-   height="%f">' % (101 * scale, 901 * scale)
-
-
-def _svg_footer():
-    ''' Return standard footer for SVG bones '''
-    return '</svg>\
-'
-
-def _svg_single_box(a, scale=1.0):
-    ''' Return standard top-of-column box for SVG bones '''
-    return '    <g>\
-      <rect\
-	  width="%f"\
-	  height="%f"\
-	  x="%f"\
-	  y="%f"\
-	  style="fill:#ffffff;stroke:#000000;stroke-width:%f;stroke-linecap:square;stroke-linejoin:round;stroke-miterlimit:%f;stroke-opacity:1;stroke-dasharray:none" />\
-      <text\
-      style="font-size:%fpx;font-style:normal;font-weight:bold;fill:#000000;fill-opacity:1;stroke:none;font-family:Sans;text-align:center;text-anchor:middle">\
-	<tspan x="%f" y="%f">\
-	  %d\
-	</tspan>\
-      </text>\
-    </g>' % (99 * scale, 99 * scale, scale, scale, 2 * scale,
-             4 * scale, 40 * scale, 55 * scale, 65 * scale, a)
-
-
-def _svg_double_box(a, b, y, scale=1.0):
-    ''' Return standard double-digit box for SVG bones '''
-    return '    <g>\
-      <rect\
-	  width="%f"\
-	  height="%f"\
-	  x="%f"\
-	  y="%f"\
-	  style="fill:#ffffff;stroke:none;stroke-width:%f;stroke-linecap:square;stroke-linejoin:round;stroke-miterlimit:%f;stroke-opacity:1;stroke-dasharray:none" />\
-      <line\
-	  x1="%f"\
-	  y1="%f"\
-	  x2="%f"\
-	  y2="%f"\
-	  style="fill:none;stroke:#000000;stroke-width:%f;stroke-linecap:butt;stroke-linejoin:miter;stroke-miterlimit:%f;stroke-opacity:1;stroke-dasharray:none" />\
-      <line\
-	  x1="%f"\
-	  y1="%f"\
-	  x2="%f"\
-	  y2="%f"\
-	  style="fill:none;stroke:#000000;stroke-width:%f;stroke-linecap:butt;stroke-linejoin:miter;stroke-miterlimit:%f;stroke-opacity:1;stroke-dasharray:none" />\
-      <text\
-	  style="font-size:%fpx;font-style:normal;font-weight:bold;fill:#000000;fill-opacity:1;stroke:none;font-family:Sans">\
-	<tspan x="%f" y="%f">\
-	  %d\
-	</tspan>\
-      </text>\
-      <text\
-      style="font-size:%fpx;font-style:normal;font-weight:bold;fill:#000000;fill-opacity:1;stroke:none;font-family:Sans">\
-	<tspan x="%f" y="%f">\
-	  %d\
-	</tspan>\
-      </text>\
-    </g>' % (99 * scale, 99 * scale, scale, y * scale, 2 * scale,
-             4 * scale, scale, (y + 99) * scale, 99 * scale,
-             (y + 1) * scale, 2 * scale, 4 * scale, scale, (y + 1) * scale,
-             99 * scale, (y + 1) * scale, 2 * scale, 4 * scale, 40 * scale,
-             12 * scale, (y + 51) * scale, a, 40 * scale, 54 * scale,
-             (y + 85) * scale, b)
-
-
-def _bone_factory(value, scale=1.0):
-    svg = _svg_header(scale=scale)
-    svg += _svg_single_box(value, scale=scale)
-    for i in range(9):
-        if i > 0:
-            j = (i + 1) * value
-            svg += _svg_double_box(int(j / 10), j % 10, i * 100, scale=scale)
-    return svg + _svg_footer()
-
-
-def _svg_str_to_pixbuf(svg_string):
-    ''' Load pixbuf from SVG string '''
-    pl = GdkPixbuf.PixbufLoader.new_with_type('svg')
-    pl.write(bytes(svg_string, 'utf-8'))
-    pl.close()
-    pixbuf = pl.get_pixbuf()
-    return pixbuf
-
-
-def _load_svg_from_file(file_path, width, height):
-    '''Create a pixbuf from SVG in a file. '''
-    return GdkPixbuf.Pixbuf.new_from_file_at_size(file_path, width, height)
+# Set NAPIER_PRERENDER in the environment to render all ten digit
+# bones in a background thread while the activity starts.
+PRERENDER_BONES = 'NAPIER_PRERENDER' in os.environ
+# Set NAPIER_CAIRO_BONES in the environment to draw the digit bones
+# directly with cairo instead of generating and parsing SVG.
+CAIRO_BONES = 'NAPIER_CAIRO_BONES' in os.environ
+# Set NAPIER_PROFILE in the environment to record frame timing, draw and
+# handler statistics, shown over the canvas and logged every
+# PROFILE_INTERVAL seconds. NAPIER_PROFILE=/path/to/file chooses the log.
+PROFILE = os.environ.get('NAPIER_PROFILE')
+PROFILE_INTERVAL = 10
+# Wait this long (ms) after the last resize before laying out again.
+RELAYOUT_DELAY = 200
+# The most digits of each number shown in the status line
+STATUS_DIGITS = 28
+# The width of the products panel, in bones
+PANEL_BONES = 4
+# The bones and the products panel only change when the number does, so
+# they are drawn from a cache; the circles and ovals move over them.
+STATIC_LAYER = 100
+OVERLAY_LAYER = 150
+
+
+def _parse_digits(text):
+    ''' Return the decimal digits in a string, as a bytearray of values '''
+    return bytearray([ord(c) - 48 for c in text if '0' <= c <= '9'])
+
+
+def _append_to_int(number, digits):
+    ''' Return number with digits appended to its decimal representation '''
+    # Convert a few thousand digits at a time: int(str) has a length limit
+    # and multiplying by ten once per digit is quadratic.
+    for i in range(0, len(digits), 4000):
+        chunk = digits[i:i + 4000]
+        number = number * 10 ** len(chunk) + int(to_string(chunk))
+    return number
+
+
+def _units_end(digits, chars):
+    ''' Return a number as a string of at most chars characters, cut to
+    its units end if need be '''
+    start = 0
+    while start < len(digits) - 1 and digits[start] == 0:
+        start += 1
+    if len(digits) - start <= chars:
+        return to_string(memoryview(digits)[start:])
+    return '…' + ''.join([str(d) for d in digits[1 - chars:]])
+
+
+def _show_text(cr, text, x, y, size, bold=False, centre=False):
+    ''' Draw a line of text with its top-left corner (or its centre) at
+    (x, y) '''
+    pl = PangoCairo.create_layout(cr)
+    fd = Pango.FontDescription('Monospace Bold' if bold else 'Monospace')
+    fd.set_absolute_size(size * Pango.SCALE)
+    pl.set_font_description(fd)
+    pl.set_text(text, -1)
+    if centre:
+        w, h = pl.get_pixel_size()
+        x -= w / 2.
+        y -= h / 2.
+    cr.move_to(x, y)
+    PangoCairo.show_layout(cr, pl)
 
 
 class NapierActivity(activity.Activity):
@@ -161,26 +129,81 @@ class NapierActivity(activity.Activity):
                                       'bones')
         else:
             self._bone_path = os.path.join('.', 'bones')
+        self._bone_cache = BoneCache(os.path.join(
+            activity.get_activity_root(), 'data', 'bones-cache'))
 
         self._bones = []
-        self._bone_images = [None, None, None, None, None, None, None, None,
-                             None, None]
+        self._bone_images = BoneImageCache()  # rendered bones, any scale
+        self._atlas_bones = {}  # digit -> AtlasImage at the current scale
+        self._stale_images = {}  # digit -> ScaledImage, until re-rendered
+        self._rerender = []  # digits waiting to be rendered at _scale
+        self._rerender_id = None
+        self._relayout_id = None
+        # (digit, scale) -> image; shared with the pre-render thread and
+        # guarded by _bone_locks.
+        self._rendered_bones = {}
+        self._bone_locks = [threading.Lock() for i in range(10)]
         self._blank_image = None
+        self._bone_index = None
+        self._lattice_panel = None
+        self._products = Products()  # every product of the multiplicand
+        self._products_panel = None
+        self._overlays_ready = False  # the circles, ovals and lattice panel
+        self._restored = False
+        self._first_frame = None  # seconds from START_TIME
+        self._startup = self._startup_stages()
         self._number = 0
         self._number_of_bones = 0
+        self._digits = bytearray()  # every digit entered, left to right
+        self._first = 0  # the digit shown in the leftmost bone
+        self._lattice = Lattice()
+        self._lattice_mode = False  # are digits entered into the multiplier?
+        self._factor = 0  # the row under the pointer
+        self._shown = None  # what the overlays currently show
+        self._tick_id = None
+        self._typed = bytearray()  # digits typed or pasted, not yet shown
+        self._typed_id = None
+
+        self._profiler = None
+        if PROFILE is not None:
+            if os.path.dirname(PROFILE) != '':
+                log_path = PROFILE
+            else:
+                log_path = os.path.join(activity.get_activity_root(),
+                                        'instance', 'napier-profile.log')
+            self._profiler = Profiler(log_path)
 
         self._setup_toolbars()
         self._setup_canvas()
-        self._circles = [None, None]
-        self._ovals = []
+        self._circles = None  # a SpritePool, once the overlays are set up
+        self._ovals = None
+        # Only what the first frame shows (the index and blank bones) is
+        # set up now; the rest is set up when idle, after it is drawn.
         self._setup_workspace()
+
+    def _startup_stages(self):
+        ''' The parts of the activity that are not needed for the first
+        frame, one per idle callback '''
+        if PRERENDER_BONES:
+            self._start_prerender()
+            yield
+        self._setup_overlays()
+        yield
         self._restore()
+        yield
+        self._setup_bones_toolbar()
+
+    def _startup_cb(self):
+        ''' Run the next startup stage '''
+        try:
+            next(self._startup)
+        except StopIteration:
+            return False
+        return True
 
     def _setup_canvas(self):
         ''' Create a canvas '''
         self._canvas = Gtk.DrawingArea()
-        self._canvas.set_size_request(Gdk.Screen.width(),
-                                      Gdk.Screen.height())
         self.set_canvas(self._canvas)
         self._canvas.show()
         self.show_all()
@@ -188,40 +211,305 @@ class NapierActivity(activity.Activity):
         self._canvas.add_events(Gdk.EventMask.BUTTON_PRESS_MASK)
         self._canvas.add_events(Gdk.EventMask.BUTTON_RELEASE_MASK)
         self._canvas.add_events(Gdk.EventMask.POINTER_MOTION_MASK)
+        self._canvas.add_events(Gdk.EventMask.SCROLL_MASK)
+        self._canvas.add_events(Gdk.EventMask.KEY_PRESS_MASK)
+        self._canvas.set_can_focus(True)
         self._canvas.connect("draw", self.__draw_cb)
         self._canvas.connect("motion-notify-event", self._mouse_move_cb)
-        # self._canvas.connect("key_press_event", self._key_press_cb)
+        self._canvas.connect("scroll-event", self._scroll_cb)
+        self._canvas.connect("size-allocate", self._size_allocate_cb)
+        self._canvas.connect("key-press-event", self._key_press_cb)
 
     def _setup_workspace(self):
         ''' Add the bones. '''
+        # Generate the sprites we'll need...
+        self._sprites = Sprites(self._canvas)
+        self._sprites.set_static_layer(STATIC_LAYER)
+        if self._profiler is not None:
+            self._sprites.profiler = self._profiler
+            GLib.timeout_add_seconds(PROFILE_INTERVAL, self._profiler.dump)
+            GLib.timeout_add(1000, self._refresh_hud_cb)
+        # Until the canvas has been allocated, assume it fills the screen.
         self._width = Gdk.Screen.width()
         self._height = int(Gdk.Screen.height() - (GRID_CELL_SIZE * 2))
-        self._scale = self._height * 1.0 / BONE_HEIGHT
+        self._set_scale(self._height * 1.0 / BONE_HEIGHT)
+        self._layout()
+
+    def _set_scale(self, scale):
+        ''' Load the assets for a new scale '''
+        self._scale = scale
         self._bone_width = int(BONE_WIDTH * self._scale)
         self._bone_height = int(BONE_HEIGHT * self._scale)
-
-        # Generate the sprites we'll need...
-        self._sprites = Sprites(self._canvas)
-        self._bone_index = Sprite(self._sprites, 0, 0, _load_svg_from_file(
-                os.path.join(self._bone_path, 'bones-index.svg'),
-                self._bone_width, self._bone_height))
-        self._max_bones = int(self._width / self._bone_width) - 1
-        self._blank_image = _load_svg_from_file(
-                os.path.join(self._bone_path, 'blank-bone.svg'),
-                self._bone_width, self._bone_height)
-        for bones in range(self._max_bones):
-            self._bones.append(Sprite(self._sprites, bones * self._bone_width,
-                                      0, self._blank_image))
-        circle_image = _load_svg_from_file(
-            os.path.join(self._bone_path, 'circle.svg'), int(self._scale * 45),
-            int(self._scale * 45))
-        self._circles[0] = Sprite(self._sprites, 0, -100, circle_image)
-        self._circles[1] = Sprite(self._sprites, 0, -100, circle_image)
-        oval_image = _load_svg_from_file(
-            os.path.join(self._bone_path, 'oval.svg'), int(self._scale * 129),
-            int(self._scale * 92))
-        for bones in range(self._max_bones - 1):
-            self._ovals.append(Sprite(self._sprites, 0, -100, oval_image))
+        self._panel_width = PANEL_BONES * self._bone_width
+
+        # All of the images at one scale share one atlas: the index and
+        # blank bones, the ten digit bones, the circle and the oval.
+        self._atlas = Atlas(
+            int(12 * self._bone_width + 174 * self._scale) + 12,
+            self._bone_height)
+        self._index_image = self._atlas.add(self._load_asset(
+            'bones-index.svg', self._bone_width, self._bone_height))
+        self._blank_image = self._atlas.add(self._load_asset(
+            'blank-bone.svg', self._bone_width, self._bone_height))
+        if self._overlays_ready:
+            self._load_overlay_assets()
+        # Bones rendered at an old scale stand in until they are rendered
+        # again; bones from the pre-render thread are dropped. The old
+        # atlas goes once no sprite shows it.
+        self._atlas_bones = {}
+        self._stale_images = {}
+        self._rerender = []
+        self._rendered_bones = {}
+
+    def _load_overlay_assets(self):
+        ''' Load the circle and the oval at the current scale '''
+        self._circle_image = self._atlas.add(self._load_asset(
+            'circle.svg', int(self._scale * 45), int(self._scale * 45)))
+        self._oval_image = self._atlas.add(self._load_asset(
+            'oval.svg', int(self._scale * 129), int(self._scale * 92)))
+
+    def _setup_overlays(self):
+        ''' Add the circles, the ovals and the panels '''
+        self._overlays_ready = True
+        self._load_overlay_assets()
+        with self._sprites.batch():
+            self._layout_overlays()
+
+    def _layout(self):
+        ''' Size and place the sprites for the current width and scale.
+        Sprites are reused (and made or hidden) as needed. '''
+        # Only the bones in view have sprites; they are recycled as the
+        # strip scrolls.
+        self._max_bones = int((self._width - self._panel_width) /
+                              self._bone_width) - 1
+        self._first = max(0, min(self._first,
+                                 self._number_of_bones - self._max_bones + 1))
+        with self._sprites.batch():
+            if self._bone_index is None:
+                self._bone_index = Sprite(self._sprites, 0, 0,
+                                          self._index_image)
+            else:
+                self._bone_index.set_shape(self._index_image)
+            while len(self._bones) > self._max_bones:
+                self._bones.pop().remove()
+            for slot, bone in enumerate(self._bones):
+                bone.move((slot * self._bone_width, 0))
+            if len(self._bones) > 0:  # the slot over the index
+                self._bones[0].set_shape(self._blank_image)
+            while len(self._bones) < self._max_bones:
+                self._bones.append(Sprite(
+                    self._sprites, len(self._bones) * self._bone_width, 0,
+                    self._blank_image))
+            self._update_bones()
+            if self._overlays_ready:
+                self._layout_overlays()
+
+    def _layout_overlays(self):
+        ''' Size the overlay sprites for the current scale '''
+        if self._circles is None:
+            # Hit tests follow the round outlines, not the boxes.
+            self._circles = SpritePool(self._sprites, self._circle_image,
+                                       OVERLAY_LAYER, mask=True)
+            self._ovals = SpritePool(self._sprites, self._oval_image,
+                                     OVERLAY_LAYER, mask=True)
+        else:
+            self._circles.set_image(self._circle_image)
+            self._ovals.set_image(self._oval_image)
+        if self._lattice_panel is not None:
+            self._lattice_panel.remove()
+        self._setup_lattice_panel()
+        self._update_lattice()
+        self._update_products_panel()
+        self._shown = None
+        self._show_product(self._factor)
+
+    def _size_allocate_cb(self, widget, allocation):
+        ''' Lay out again once the canvas has stopped changing size '''
+        if self._relayout_id is not None:
+            GLib.source_remove(self._relayout_id)
+        self._relayout_id = GLib.timeout_add(
+            RELAYOUT_DELAY, self._relayout_cb, allocation.width,
+            allocation.height)
+
+    def _relayout_cb(self, width, height):
+        ''' Fit the bones to a new canvas size '''
+        self._relayout_id = None
+        scale = height * 1.0 / BONE_HEIGHT
+        # Ignore changes too small to see; re-rendering is not free.
+        rescale = abs(scale - self._scale) > 0.01 * self._scale
+        if not rescale and width == self._width:
+            return False
+        self._width = width
+        self._height = height
+        if rescale:
+            self._set_scale(scale)
+        self._layout()
+        return False
+
+    def _setup_lattice_panel(self):
+        ''' Create the overlay showing the lattice (lattice mode) '''
+        width = self._bone_width * 5
+        self._lattice_panel = Sprite(
+            self._sprites, self._width - self._panel_width - width, 0,
+            cairo.ImageSurface(cairo.FORMAT_ARGB32, width, self._bone_height))
+        self._lattice_panel.set_layer(200)
+        self._lattice_panel.hide()
+
+    def _update_products_panel(self):
+        ''' Show the products of the multiplicand by 1 to 9 beside the
+        bones. Called when the number or the layout changes. '''
+        if not self._overlays_ready:
+            return
+        surface = self._render_products_panel()
+        if self._products_panel is None:
+            self._products_panel = Sprite(
+                self._sprites, self._width - self._panel_width, 0, surface)
+        else:
+            self._products_panel.move((self._width - self._panel_width, 0))
+            self._products_panel.set_shape(surface)
+
+    def _render_products_panel(self):
+        ''' Draw each product, with the diagonal sums that it is read
+        from, level with its row of the bones '''
+        width = self._panel_width
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width,
+                                     self._bone_height)
+        cr = cairo.Context(surface)
+        cr.set_source_rgba(1, 1, 1, 0.9)
+        cr.paint()
+        cr.set_source_rgb(0, 0, 0)
+        cr.set_line_width(2 * self._scale)
+        cr.rectangle(self._scale, self._scale, width - 2 * self._scale,
+                     self._bone_height - 2 * self._scale)
+        cr.stroke()
+
+        margin = 10 * self._scale
+        size = self._bone_width / 5.
+        small = self._bone_width / 7.
+        # Only the units end of a long number fits; don't lay out more
+        # than that. Monospace characters are about 0.6 em wide.
+        chars = max(4, int((width - 2 * margin) / (0.6 * size)) - 3)
+        cells = max(2, int((width - 2 * margin) / (0.6 * small) / 3))
+        products = self._products
+        for i, factor in enumerate(products.factors):
+            y = i * 100 * self._scale + margin
+            row = products.rows[i]
+            if len(row) > chars:
+                text = '…' + ''.join([str(d) for d in row[1 - chars:]])
+            else:
+                text = to_string(row)
+            cr.set_source_rgb(0, 0, 0)
+            _show_text(cr, '%d× %s' % (factor, text), margin, y, size,
+                       bold=True)
+            if len(products.digits) == 0:
+                continue
+            sums = products.sums[i]
+            text = ' '.join([str(d) for d in sums[-cells:]])
+            if len(sums) > cells:
+                text = '… ' + text
+            cr.set_source_rgb(0.4, 0.4, 0.4)
+            _show_text(cr, text, margin, y + size * 1.5, small)
+        surface.flush()
+        return surface
+
+    def _load_asset(self, name, width, height):
+        ''' Load an SVG asset from the bones directory, via the cache '''
+        path = os.path.join(self._bone_path, name)
+        with open(path, 'rb') as fd:
+            template = fd.read()
+        return self._bone_cache.get(
+            name, None, (width, height), template,
+            lambda: load_svg_from_file(path, width, height))
+
+    def _load_bone(self, value, scale):
+        ''' Generate the bone for a digit, via the cache '''
+        if CAIRO_BONES:  # Cheaper to draw than to decode a cached PNG
+            return cairo_bone_factory(value, scale=scale)
+        svg = bone_factory(value, scale=scale)
+        return self._bone_cache.get('bone', value, scale, svg,
+                                    lambda: svg_str_to_pixbuf(svg))
+
+    def _render_bone(self, value, scale):
+        ''' Return the bone for a digit, rendering it at most once per
+        scale. Safe to call from the pre-render thread. '''
+        # _set_scale may replace the dict at any time; use one and the
+        # same dict, and return the image itself rather than looking it
+        # up again.
+        rendered = self._rendered_bones
+        with self._bone_locks[value]:
+            image = rendered.get((value, scale))
+            if image is None:
+                image = self._load_bone(value, scale)
+                rendered[(value, scale)] = image
+            return image
+
+    def _add_bone(self, value, image):
+        ''' Add a bone rendered at the current scale to the atlas and the
+        image cache. The cache keeps the image itself, not the AtlasImage,
+        which would keep the whole atlas alive. '''
+        atlas_image = self._atlas.add(image)
+        self._atlas_bones[value] = atlas_image
+        self._bone_images.put(value, self._scale, image)
+        self._stale_images.pop(value, None)
+        return atlas_image
+
+    def _bone_image(self, value):
+        ''' Return the image for a digit at the current scale. If there is
+        only one at another scale, return it scaled and render the right
+        one later. '''
+        if value in self._atlas_bones:
+            return self._atlas_bones[value]
+        image = self._bone_images.get(value, self._scale)
+        if image is not None:  # rendered at this scale before
+            return self._add_bone(value, image)
+        if value in self._stale_images:
+            return self._stale_images[value]
+        stale = self._bone_images.nearest(value, self._scale)
+        if stale is None:
+            # Not pre-rendered (yet): render it now, or wait for the
+            # pre-render thread if it is already working on this digit.
+            return self._add_bone(value, self._render_bone(value,
+                                                           self._scale))
+        self._stale_images[value] = ScaledImage(stale, self._bone_width,
+                                                self._bone_height)
+        self._rerender.append(value)
+        if self._rerender_id is None:
+            self._rerender_id = GLib.idle_add(self._rerender_cb,
+                                              priority=GLib.PRIORITY_LOW)
+        return self._stale_images[value]
+
+    def _rerender_cb(self):
+        ''' Render one stale bone at the current scale, when idle '''
+        if len(self._rerender) > 0:
+            value = self._rerender.pop(0)
+            if value not in self._atlas_bones:
+                self._add_bone(value, self._render_bone(value, self._scale))
+                self._update_bones()
+        if len(self._rerender) > 0:
+            return True
+        self._rerender_id = None
+        return False
+
+    def _start_prerender(self):
+        ''' Render the ten digit bones in a background thread '''
+        thread = threading.Thread(target=self._prerender_bones,
+                                  args=(self._scale,))
+        thread.daemon = True
+        thread.start()
+
+    def _prerender_bones(self, scale):
+        ''' Worker thread: render each bone, then hand it to the main loop '''
+        for value in range(10):
+            GLib.idle_add(self._bone_ready_cb, value, scale,
+                          self._render_bone(value, scale))
+
+    def _bone_ready_cb(self, value, scale, image):
+        ''' Main loop: accept a bone from the pre-render thread '''
+        if scale == self._scale and value not in self._atlas_bones:
+            self._add_bone(value, image)
+            if value in self._digits:
+                self._update_bones()
+        return False
 
     def _setup_toolbars(self):
         ''' Setup the toolbars. '''
@@ -252,6 +540,20 @@ class NapierActivity(activity.Activity):
             'erase', self.toolbar, self._new_calc_cb, tooltip=_('Clear'))
 
         self._status = label_factory(self.toolbar, '')
+        # Products of long numbers can be very long.
+        self._status.set_line_wrap(False)
+        self._status.set_ellipsize(Pango.EllipsizeMode.MIDDLE)
+        self._status.set_max_width_chars(2 * STATUS_DIGITS + 4)
+
+        separator_factory(toolbox.toolbar, True, False)
+        stop_button = StopButton(self)
+        stop_button.props.accelerator = '<Ctrl>q'
+        toolbox.toolbar.insert(stop_button, -1)
+        stop_button.show()
+        self._bones_toolbar_button.set_expanded(True)
+
+    def _setup_bones_toolbar(self):
+        ''' Fill in the bones toolbar '''
 
         button_factory('number-0', self._bones_toolbar, self._number_cb,
                         cb_arg=0, tooltip=_('zero'))
@@ -283,71 +585,337 @@ class NapierActivity(activity.Activity):
         button_factory('number-9', self._bones_toolbar, self._number_cb,
                         cb_arg=9, tooltip=_('nine'))
 
-        separator_factory(toolbox.toolbar, True, False)
-        stop_button = StopButton(self)
-        stop_button.props.accelerator = '<Ctrl>q'
-        toolbox.toolbar.insert(stop_button, -1)
-        stop_button.show()
-        self._bones_toolbar_button.set_expanded(True)
+        separator_factory(self._bones_toolbar)
+
+        multiplicand_button = radio_factory(
+            'bones', self._bones_toolbar, self._entry_mode_cb, cb_arg=False,
+            tooltip=_('Enter the multiplicand'))
+
+        radio_factory('multiplier', self._bones_toolbar, self._entry_mode_cb,
+                      cb_arg=True, tooltip=_('Enter a multiplier'),
+                      group=multiplicand_button)
 
     def _new_calc_cb(self, button=None):
         ''' Start a new calculation. '''
-        for bone in range(self._max_bones):
-            self._bones[bone].set_shape(self._blank_image)
-            self._bones[bone].inval()
+        self._digits = bytearray()
         self._number_of_bones = 0
         self._number = 0
+        self._first = 0
+        self._lattice = Lattice()
+        self._products = Products()
+        self._update_bones()
+        self._update_lattice()
+        self._update_products_panel()
         self._status.set_label('')
         return
 
+    def _entry_mode_cb(self, button, lattice_mode):
+        ''' Choose whether digits go to the multiplicand or the multiplier '''
+        if button.get_active():
+            self._lattice_mode = lattice_mode
+
+    @profiled
     def _number_cb(self, button=None, value=0):
-        ''' Try to add a digit. '''
-        if self._number_of_bones == self._max_bones:
+        ''' Add a digit. '''
+        self._add_digits((value,))
+
+    def _add_digits(self, digits):
+        ''' Add digits to the multiplicand, or to the multiplier in lattice
+        mode, laying out the bones once for all of them. '''
+        if self._lattice_mode:
+            for value in digits:
+                self._lattice.add_multiplier_digit(value)
+            self._update_lattice()
+        else:
+            self._add_multiplicand_digits(digits)
+
+    def _set_number(self, digits):
+        ''' Replace the multiplicand, laying out the bones once '''
+        multiplier = self._lattice.multiplier
+        self._lattice = Lattice()
+        for value in multiplier:
+            self._lattice.add_multiplier_digit(value)
+        self._digits = bytearray()
+        self._number = 0
+        self._first = 0
+        self._products = Products()
+        self._add_multiplicand_digits(digits)
+
+    def _add_multiplicand_digits(self, digits):
+        ''' Append digits to the multiplicand and show them '''
+        digits = bytearray(digits)
+        self._lattice.add_multiplicand_digits(digits)
+        self._digits.extend(digits)
+        self._number_of_bones = len(self._digits)
+        self._number = _append_to_int(self._number, digits)
+        self._products.append(digits)
+        with self._sprites.batch():
+            if len(self._lattice.multiplier) > 0:
+                self._update_lattice()
+            self._update_products_panel()
+            # Keep the last digit in view.
+            if self._number_of_bones - self._first > self._max_bones - 1:
+                self._scroll_to(self._number_of_bones - self._max_bones + 1)
+            else:
+                self._update_bones()
+
+    def _update_lattice(self):
+        ''' Draw the lattice for the multiplicand and the multiplier '''
+        if not self._overlays_ready:
+            return
+        if len(self._lattice.multiplier) == 0:
+            self._lattice_panel.hide()
+            return
+        with self._sprites.batch():
+            self._lattice_panel.set_shape(self._render_lattice_panel())
+            self._lattice_panel.restore()
+
+    def _render_lattice_panel(self):
+        ''' Draw the lattice: the multiplicand across the top and the
+        multiplier down the right. Each cell holds the tens and units of
+        a row of a bone; the carried sums of the diagonals run down the
+        left and along the bottom, and the product is written below. '''
+        width = self._lattice_panel.rect[2]
+        height = self._bone_height
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        cr = cairo.Context(surface)
+        cr.set_source_rgba(1, 1, 1, 0.9)
+        cr.paint()
+        cr.set_source_rgb(0, 0, 0)
+        cr.set_line_width(2 * self._scale)
+        cr.rectangle(self._scale, self._scale, width - 2 * self._scale,
+                     height - 2 * self._scale)
+        cr.stroke()
+
+        margin = 10 * self._scale
+        cell = 0.6 * self._bone_width
+        band = 0.6 * cell  # for the digits around the grid
+        size = 0.4 * cell
+        small = 0.3 * cell
+        # Only the units end of long numbers fits, but every digit shown
+        # is right: the low digits of a product only depend on the low
+        # digits of its factors.
+        multiplicand = self._lattice.multiplicand
+        multiplier = self._lattice.multiplier
+        columns = min(len(multiplicand),
+                      max(1, int((width - 2 * margin - 2 * band) / cell)))
+        rows = min(len(multiplier),
+                   max(1, int((height - 2 * margin - 3 * band) / cell)))
+        left = width - margin - band - columns * cell
+        top = margin + band
+        right = left + columns * cell
+        bottom = top + rows * cell
+
+        cr.set_line_width(self._scale)
+        for c in range(columns + 1):
+            cr.move_to(left + c * cell, top)
+            cr.line_to(left + c * cell, bottom)
+        for r in range(rows + 1):
+            cr.move_to(left, top + r * cell)
+            cr.line_to(right, top + r * cell)
+        # One diagonal through each cell, from top right to bottom left
+        for c in range(columns):
+            for r in range(rows):
+                cr.move_to(left + (c + 1) * cell, top + r * cell)
+                cr.line_to(left + c * cell, top + (r + 1) * cell)
+        cr.stroke()
+
+        tail = multiplicand[-columns:]
+        for c, value in enumerate(tail):
+            _show_text(cr, str(value), left + (c + 0.5) * cell,
+                       margin + band / 2, size, bold=True, centre=True)
+        if len(multiplicand) > columns:
+            _show_text(cr, '…', left - band / 2, margin + band / 2, size,
+                       centre=True)
+        _show_text(cr, '⋮' if len(multiplier) > rows else '×',
+                   right + band / 2, margin + band / 2, size, centre=True)
+        for r, factor in enumerate(multiplier[-rows:]):
+            _show_text(cr, str(factor), right + band / 2,
+                       top + (r + 0.5) * cell, size, bold=True, centre=True)
+            for c, value in enumerate(tail):
+                tens, units = divmod(factor * value, 10)
+                _show_text(cr, str(tens), left + (c + 0.3) * cell,
+                           top + (r + 0.3) * cell, small, centre=True)
+                _show_text(cr, str(units), left + (c + 0.7) * cell,
+                           top + (r + 0.7) * cell, small, centre=True)
+
+        # The diagonal holding the units of the bottom right cell is digit
+        # 0 of the product; each step left or up is one digit higher.
+        product = to_string(self._lattice.total)
+        cr.set_source_rgb(0, 0, 0.6)
+        for c in range(columns):
+            p = columns - 1 - c
+            if p < len(product):
+                _show_text(cr, product[-1 - p], left + (c + 0.5) * cell,
+                           bottom + band / 2, size, bold=True, centre=True)
+        for r in range(rows):
+            p = columns + rows - 1 - r
+            if p < len(product):
+                _show_text(cr, product[-1 - p], left - band / 2,
+                           top + (r + 0.5) * cell, size, bold=True,
+                           centre=True)
+        chars = max(4, int((width - 2 * margin) / (0.6 * size)) - 2)
+        if len(product) > chars:
+            product = '…' + product[1 - chars:]
+        _show_text(cr, '= ' + product, margin, bottom + band, size, bold=True)
+        surface.flush()
+        return surface
+
+    def _update_bones(self):
+        ''' Show the digits from self._first onward in the bones in view '''
+        with self._sprites.batch():
+            for slot in range(1, self._max_bones):
+                i = self._first + slot - 1
+                if i < self._number_of_bones:
+                    image = self._bone_image(self._digits[i])
+                else:
+                    image = self._blank_image
+                if self._bones[slot].images[0] is not image:
+                    self._bones[slot].set_shape(image)
+
+    def _scroll_to(self, first):
+        ''' Scroll the bone strip so that digit first is leftmost '''
+        first = max(0, min(first, self._number_of_bones - self._max_bones + 1))
+        if first == self._first:
             return
-        self._number_of_bones += 1
-        if self._bone_images[value] is None:
-            self._bone_images[value] = _svg_str_to_pixbuf(
-                _bone_factory(value, scale=self._scale))
-        self._bones[self._number_of_bones].set_shape(self._bone_images[value])
-        self._bones[self._number_of_bones].inval()
-        self._number = self._number * 10 + value
+        self._first = first
+        self._update_bones()
+        self._show_product(self._factor)
+
+    def _scroll_cb(self, win, event):
+        ''' Scroll the bone strip with the mouse wheel or touchpad '''
+        if event.direction in (Gdk.ScrollDirection.UP,
+                               Gdk.ScrollDirection.LEFT):
+            self._scroll_to(self._first - 1)
+        elif event.direction in (Gdk.ScrollDirection.DOWN,
+                                 Gdk.ScrollDirection.RIGHT):
+            self._scroll_to(self._first + 1)
+        else:  # smooth scrolling
+            ok, dx, dy = event.get_scroll_deltas()
+            if dx + dy < 0:
+                self._scroll_to(self._first - 1)
+            elif dx + dy > 0:
+                self._scroll_to(self._first + 1)
+        return True
 
+    @profiled
     def _mouse_move_cb(self, win, event):
         ''' Determine which row we are in and then calculate the product. '''
         win.grab_focus()
         x, y = list(map(int, event.get_coords()))
-        factor = int(y / self._bone_width)  # The row determines a factor
-
-        if self._number == 0 or factor == 0:
-            self._status.set_label('')
-            self._circles[0].move((0, -100))
-            self._circles[1].move((0, -100))
-            for number in range(self._max_bones - 1):
-                self._ovals[number].move((0, -100))
-        else:
-            c0dx = int(4 * self._scale)
-            c0dy = int(12 * self._scale)
-            c1dx = int(44 * self._scale)
-            c1dy = int(47 * self._scale)
-            odx = int(42 * self._scale)
-            ody = int(2 * self._scale)
-            self._circles[0].move((self._bone_width + c0dx,
-                                   factor * self._bone_width + c0dy))
-            self._circles[1].move((
-                    self._number_of_bones * self._bone_width + c1dx,
-                    factor * self._bone_width + c1dy))
-            for number in range(self._number_of_bones - 1):
-                self._ovals[number].move(((number + 1) * self._bone_width + odx,
-                                          factor * self._bone_width + ody))
-            self._status.set_label('{}×{}={}'.format(factor + 1, self._number, (factor + 1) * self._number))
+        # The row is the factor (less one); the bones have nine rows.
+        self._factor = min(int(y / self._bone_width), 8)
+        # Motion events can arrive much faster than the display refreshes,
+        # so coalesce them: the overlays are laid out once per frame.
+        if self._tick_id is None:
+            self._tick_id = self._canvas.add_tick_callback(self._tick_cb)
         return True
 
+    @profiled
+    def _tick_cb(self, widget, frame_clock):
+        ''' Lay out the overlays for the latest pointer position '''
+        self._tick_id = None
+        self._show_product(self._factor)
+        return GLib.SOURCE_REMOVE
+
+    def _show_product(self, factor):
+        ''' Highlight a row and show its product, if anything changed '''
+        if not self._overlays_ready:
+            return
+        if self._number == 0:
+            factor = 0
+        state = (factor, self._first, self._number_of_bones, self._number)
+        if state == self._shown:  # still in the same row
+            return
+        self._shown = state
+
+        with self._sprites.batch():
+            if self._number == 0 or factor == 0:
+                self._status.set_label('')
+                self._circles.hide()
+                self._ovals.hide()
+            else:
+                c0dx = int(4 * self._scale)
+                c0dy = int(12 * self._scale)
+                c1dx = int(44 * self._scale)
+                c1dy = int(47 * self._scale)
+                odx = int(42 * self._scale)
+                ody = int(2 * self._scale)
+                # Only mark the digits that are in view.
+                last = min(self._number_of_bones,
+                           self._first + self._max_bones - 1)
+                circles = []
+                if self._first == 0:
+                    circles.append((self._bone_width + c0dx,
+                                    factor * self._bone_width + c0dy))
+                if last == self._number_of_bones:
+                    circles.append((
+                            (last - self._first) * self._bone_width + c1dx,
+                            factor * self._bone_width + c1dy))
+                self._circles.show(circles)
+                self._ovals.show([((number + 1) * self._bone_width + odx,
+                                   factor * self._bone_width + ody)
+                                  for number in range(last - self._first - 1)])
+                # Pango lays out all of a label, even the part that is
+                # ellipsized, so long numbers are cut here.
+                self._status.set_label('{}×{}={}'.format(
+                    factor + 1, _units_end(self._digits, STATUS_DIGITS),
+                    _units_end(self._products.rows[factor], STATUS_DIGITS)))
+
     def _key_press_cb(self, win, event):
-        ''' TODO: Add bones by typing numbers '''
-        return True
+        ''' Add bones by typing numbers, or paste them with Ctrl+V '''
+        if event.state & Gdk.ModifierType.CONTROL_MASK:
+            if Gdk.keyval_name(event.keyval) in ('v', 'V'):
+                Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD).request_text(
+                    self._paste_cb)
+                return True
+            return False
+        char = chr(Gdk.keyval_to_unicode(event.keyval))
+        if '0' <= char <= '9':  # also the keypad digits
+            self._queue_digits(bytearray([ord(char) - 48]))
+            return True
+        return False
+
+    def _paste_cb(self, clipboard, text):
+        ''' Add the digits in the clipboard text, ignoring anything else '''
+        if text is not None:
+            self._queue_digits(_parse_digits(text))
+
+    def _queue_digits(self, digits):
+        ''' Add digits once pending input has been handled, so that a
+        burst of key presses is shown in one go '''
+        self._typed.extend(digits)
+        if self._typed_id is None:
+            self._typed_id = GLib.idle_add(self._typed_cb)
+
+    @profiled
+    def _typed_cb(self):
+        ''' Show the digits typed or pasted since the last call '''
+        self._typed_id = None
+        digits = self._typed
+        self._typed = bytearray()
+        self._add_digits(digits)
+        return False
 
     def __draw_cb(self, canvas, cr):
-        self._sprites.redraw_sprites(cr=cr)
+        if self._profiler is None:
+            self._sprites.redraw_sprites(cr=cr)
+        else:
+            start = time.perf_counter()
+            self._sprites.redraw_sprites(cr=cr)
+            self._profiler.frame(time.perf_counter() - start)
+            self._profiler.draw_hud(cr)
+        if self._first_frame is None:
+            self._first_frame = time.perf_counter() - START_TIME
+            # Logged as first_frame_ms when profiling
+            if self._profiler is not None:
+                self._profiler.first_frame = self._first_frame
+            GLib.idle_add(self._startup_cb)
+
+    def _refresh_hud_cb(self):
+        ''' Redraw the profiler HUD once a second '''
+        self._canvas.queue_draw_area(*self._profiler.hud_rect())
+        return True
 
     def do_expose_event(self, event):
         ''' Handle the expose-event by drawing '''
@@ -364,13 +932,14 @@ class NapierActivity(activity.Activity):
 
     def _restore(self):
         ''' Try to restore previous state. '''
+        self._restored = True
         if 'number' in self.metadata and self.metadata['number'] != '0':
-            for digit in range(len(self.metadata['number'])):
-                self._number_cb(button=None,
-                                value=int(self.metadata['number'][digit]))
+            self._set_number(_parse_digits(self.metadata['number']))
 
     def write_file(self, file_path):
         ''' Write the status to the Journal. '''
-        if not hasattr(self, '_number'):
+        # Do not overwrite the saved number if it has not been restored.
+        if not getattr(self, '_restored', False):
             return
-        self.metadata['number'] = str(self._number)
+        self.metadata['number'] = ''.join([str(d) for d in self._digits]) \
+            or '0'
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#Copyright (c) 2026 agent
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+'''
+
+benchmark.py times the hot paths of the activity, offscreen, and
+writes the results as JSON so that they can be compared across
+commits:
+
+        ./benchmark.py -o before.json
+        git checkout other-branch
+        ./benchmark.py -o after.json
+
+Each result records the benchmark name, its parameters and the best
+and median time per call, in seconds. Use --filter to run a subset,
+and --quick for fewer repetitions.
+
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import statistics
+import subprocess
+import timeit
+
+import cairo
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Pango
+
+from bone_renderer import bone_factory, cairo_bone_factory, \
+    svg_str_to_pixbuf, load_svg_from_file, BONE_WIDTH, BONE_HEIGHT
+from sprites import Sprites, Sprite
+import napier
+
+BONES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bones')
+SCALES = (0.5, 1.0, 2.0)
+SIZES = (100, 1000, 10000)
+DIGITS = (100, 10000, 100000)
+WIDTH = 1200
+HEIGHT = 900
+
+
+class _Widget:
+    ''' Stands in for the Gtk.DrawingArea that Sprites invalidates '''
+
+    def queue_draw_area(self, x, y, w, h):
+        pass
+
+    def queue_draw_region(self, region):
+        pass
+
+    def get_window(self):
+        return None
+
+    def get_allocated_width(self):
+        return WIDTH
+
+    def get_allocated_height(self):
+        return HEIGHT
+
+
+def _sprites(n, image, seed=0):
+    ''' Return a Sprites list with n sprites scattered over the board '''
+    rnd = random.Random(seed)
+    sprites = Sprites(_Widget())
+    for i in range(n):
+        Sprite(sprites, rnd.randrange(WIDTH), rnd.randrange(HEIGHT), image)
+    return sprites
+
+
+def _small_image():
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 45, 45)
+    cr = cairo.Context(surface)
+    cr.arc(22.5, 22.5, 20, 0, 6.283)
+    cr.set_source_rgb(1, 0, 0)
+    cr.stroke()
+    return surface
+
+
+def bench_bone_factory():
+    for scale in SCALES:
+        yield {'scale': scale}, lambda: bone_factory(7, scale=scale)
+
+
+def bench_svg_str_to_pixbuf():
+    for scale in SCALES:
+        svg = bone_factory(7, scale=scale)
+        yield {'scale': scale}, lambda: svg_str_to_pixbuf(svg)
+
+
+def bench_cairo_bone_factory():
+    for scale in SCALES:
+        yield {'scale': scale}, lambda: cairo_bone_factory(7, scale=scale)
+
+
+def bench_load_svg_from_file():
+    path = os.path.join(BONES_PATH, 'bones-index.svg')
+    for scale in SCALES:
+        w, h = int(BONE_WIDTH * scale), int(BONE_HEIGHT * scale)
+        yield {'scale': scale}, lambda: load_svg_from_file(path, w, h)
+
+
+def bench_redraw_sprites():
+    target = cairo.ImageSurface(cairo.FORMAT_ARGB32, WIDTH, HEIGHT)
+    image = _small_image()
+    for n in SIZES:
+        sprites = _sprites(n, image)
+        cr = cairo.Context(target)
+        yield {'sprites': n}, lambda: sprites.redraw_sprites(cr=cr)
+
+
+def bench_redraw_static():
+    # Most of the sprites are static; a few move every frame, as the
+    # circles and ovals do.
+    target = cairo.ImageSurface(cairo.FORMAT_ARGB32, WIDTH, HEIGHT)
+    image = _small_image()
+    for n in SIZES:
+        sprites = _sprites(n, image)
+        sprites.set_static_layer(100)
+        movers = sprites.list[:10]
+        for spr in movers:
+            spr.set_layer(200)
+        cr = cairo.Context(target)
+        step = [1]
+
+        def frame():
+            # Back and forth, so that every frame draws the same thing
+            for spr in movers:
+                spr.move_relative((step[0], 0))
+            step[0] = -step[0]
+            sprites.redraw_sprites(cr=cr)
+        sprites.redraw_sprites(cr=cr)  # fill the cache
+        yield {'sprites': n}, frame
+
+
+def bench_draw_label():
+    target = cairo.ImageSurface(cairo.FORMAT_ARGB32, WIDTH, HEIGHT)
+    cr = cairo.Context(target)
+    sprites = Sprites(_Widget())
+    spr = Sprite(sprites, 0, 0, cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                                    200, 40))
+    for rescale in (True, False):
+        spr.set_label_attributes(24, rescale=rescale)
+        spr.set_label('7×123456789012=864197523084')
+        yield {'rescale': rescale}, lambda: spr.draw_label(cr)
+
+
+def bench_find_sprite():
+    image = _small_image()
+    rnd = random.Random(1)
+    for n in SIZES:
+        sprites = _sprites(n, image)
+        points = [(rnd.randrange(WIDTH), rnd.randrange(HEIGHT))
+                  for i in range(100)]
+        yield {'sprites': n, 'queries': len(points)}, \
+            lambda: [sprites.find_sprite(p) for p in points]
+        for spr in sprites.list:  # the same, pixel by pixel
+            spr.set_hit_mask()
+        yield {'sprites': n, 'queries': len(points), 'mask': True}, \
+            lambda: [sprites.find_sprite(p) for p in points]
+
+
+def bench_get_pixel():
+    image = _small_image()
+    sprites = Sprites(_Widget())
+    spr = Sprite(sprites, 0, 0, image)
+    points = [(x, y) for x in range(0, 45, 5) for y in range(0, 45, 5)]
+    yield {'points': len(points)}, \
+        lambda: [spr.get_pixel(p) for p in points]
+
+
+def bench_set_layer():
+    image = _small_image()
+    rnd = random.Random(2)
+    for n in SIZES:
+        sprites = _sprites(n, image)
+        changes = [(sprites.list[rnd.randrange(n)], rnd.randrange(100, 1000))
+                   for i in range(100)]
+        yield {'sprites': n, 'changes': len(changes)}, \
+            lambda: [spr.set_layer(layer) for spr, layer in changes]
+
+
+def bench_products():
+    rnd = random.Random(3)
+    engines = [False, True] if napier.numpy is not None else [False]
+    for n in DIGITS:
+        digits = bytearray([rnd.randrange(10) for i in range(n)])
+        for use_numpy in engines:
+            napier.USE_NUMPY = use_numpy
+            yield {'digits': n, 'numpy': use_numpy}, \
+                lambda: napier.products(digits)
+    napier.USE_NUMPY = napier.numpy is not None
+
+
+# Each generator yields (params, func) pairs; func is timed before the
+# generator resumes, so it may refer to the loop variables.
+BENCHMARKS = [
+    ('bone_factory', bench_bone_factory),
+    ('svg_str_to_pixbuf', bench_svg_str_to_pixbuf),
+    ('cairo_bone_factory', bench_cairo_bone_factory),
+    ('load_svg_from_file', bench_load_svg_from_file),
+    ('redraw_sprites', bench_redraw_sprites),
+    ('redraw_static', bench_redraw_static),
+    ('draw_label', bench_draw_label),
+    ('find_sprite', bench_find_sprite),
+    ('get_pixel', bench_get_pixel),
+    ('set_layer', bench_set_layer),
+    ('products', bench_products),
+]
+
+
+def _time(func, repeat):
+    ''' Return the best and median time per call, in seconds '''
+    # Pick a number of calls per run that takes about 0.1 s.
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * 0.1 / max(elapsed, 1e-9)))
+    runs = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {'number': number, 'repeat': repeat, 'best': min(runs),
+            'median': statistics.median(runs)}
+
+
+def _commit():
+    ''' Return the current git commit, if there is one '''
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Time the hot paths of the Napier activity.')
+    parser.add_argument('-o', '--output',
+                        help='write the JSON results here (default: stdout)')
+    parser.add_argument('-f', '--filter', default='',
+                        help='only run benchmarks whose name contains this')
+    parser.add_argument('--quick', action='store_true',
+                        help='repeat each benchmark 3 times instead of 7')
+    args = parser.parse_args(argv)
+
+    repeat = 3 if args.quick else 7
+    results = []
+    for name, bench in BENCHMARKS:
+        if args.filter not in name:
+            continue
+        for params, func in bench():
+            result = {'name': name, 'params': params}
+            result.update(_time(func, repeat))
+            results.append(result)
+            print('%-20s %-36s %12.3f us' % (
+                name, json.dumps(params), result['best'] * 1e6),
+                file=sys.stderr)
+
+    report = {'commit': _commit(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'cairo': cairo.cairo_version_string(),
+              'pango': Pango.version_string(),
+              'machine': platform.machine(),
+              'results': results}
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as fd:
+            json.dump(report, fd, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
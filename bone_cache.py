@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+#Copyright (c) 2026 agent
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+'''
+
+bone_cache.py keeps rasterized bones on disk so that the SVG does not
+have to be parsed and rendered again on every launch.
+
+Entries are PNG files stored in a versioned directory. Each file name
+is built from the asset name, the digit (if any), the scale and a hash
+of the SVG template, e.g.
+
+        v1/bone-7-0.8435-3f2a9c1e0b4d5a6f.png
+        v1/circle.svg--45x45-9b1c0d2e3f4a5b6c.png
+
+Only one entry per (asset, digit) is kept: storing a new entry evicts
+any entry rendered at another scale or from another template.
+
+Example usage:
+        cache = BoneCache(os.path.join(activity_root, 'data', 'bones'))
+        pixbuf = cache.get('bone', 7, scale, svg,
+                           lambda: svg_str_to_pixbuf(svg))
+
+BoneImageCache keeps the images in memory instead, at more than one
+scale, so that a resized window can show the old images (scaled) until
+the new ones are ready. It holds at most a given number of bytes and
+forgets the least recently used images first.
+
+'''
+
+import os
+import hashlib
+import shutil
+from collections import OrderedDict
+
+from gi.repository import GdkPixbuf, GLib
+
+CACHE_VERSION = 1
+IMAGE_CACHE_BUDGET = 32 * 1024 * 1024  # bytes
+
+
+def _format_scale(scale):
+    ''' Return the scale as it appears in a cache file name '''
+    if isinstance(scale, float):
+        return '%.4f' % (scale)
+    elif isinstance(scale, (tuple, list)):
+        return 'x'.join([str(s) for s in scale])
+    return str(scale)
+
+
+def _template_hash(template):
+    ''' Return a short hash of an SVG template (str or bytes) '''
+    if isinstance(template, str):
+        template = template.encode('utf-8')
+    return hashlib.sha1(template).hexdigest()[:16]
+
+
+class BoneCache:
+    ''' A versioned on-disk cache of rasterized bones '''
+
+    def __init__(self, path):
+        ''' Create (if need be) the cache directory and drop old versions '''
+        self._path = os.path.join(path, 'v%d' % (CACHE_VERSION))
+        try:
+            if not os.path.exists(self._path):
+                os.makedirs(self._path)
+            for name in os.listdir(path):
+                if name != 'v%d' % (CACHE_VERSION):
+                    shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+        except OSError as e:
+            print('bone_cache: cannot use %s (%s)' % (path, e))
+            self._path = None
+
+    def _prefix(self, asset, digit):
+        if digit is None:
+            return '%s--' % (asset)
+        return '%s-%d-' % (asset, digit)
+
+    def get(self, asset, digit, scale, template, render):
+        ''' Return a pixbuf for (asset, digit, scale, template). On a miss,
+        call render() and store its result. '''
+        if self._path is None:
+            return render()
+        prefix = self._prefix(asset, digit)
+        name = '%s%s-%s.png' % (prefix, _format_scale(scale),
+                                _template_hash(template))
+        path = os.path.join(self._path, name)
+        if os.path.exists(path):
+            try:
+                return GdkPixbuf.Pixbuf.new_from_file(path)
+            except GLib.Error as e:
+                print('bone_cache: cannot load %s (%s)' % (name, e))
+        pixbuf = render()
+        self._store(prefix, name, pixbuf)
+        return pixbuf
+
+    def _store(self, prefix, name, pixbuf):
+        ''' Write a new entry and evict stale ones for the same asset '''
+        path = os.path.join(self._path, name)
+        try:
+            # Write to a temporary file first so a crash never leaves
+            # a truncated PNG behind.
+            pixbuf.savev(path + '.tmp', 'png', [], [])
+            os.rename(path + '.tmp', path)
+            for old in os.listdir(self._path):
+                if old.startswith(prefix) and old != name:
+                    os.remove(os.path.join(self._path, old))
+        except (GLib.Error, OSError) as e:
+            print('bone_cache: cannot store %s (%s)' % (name, e))
+
+    def clear(self):
+        ''' Remove every entry from the cache '''
+        if self._path is None:
+            return
+        for name in os.listdir(self._path):
+            os.remove(os.path.join(self._path, name))
+
+
+class BoneImageCache:
+    ''' An in-memory LRU cache of bone images, keyed by (digit, scale).
+    Each image is counted as its own pixels, so it should not share a
+    larger surface (as an AtlasImage does) or the budget means nothing. '''
+
+    def __init__(self, budget=IMAGE_CACHE_BUDGET):
+        self.budget = budget
+        self.size = 0  # bytes held, counting 4 bytes per pixel
+        self._images = OrderedDict()  # (digit, scale) -> image
+
+    def _key(self, digit, scale):
+        # Scales computed from different window sizes can differ in the
+        # last few bits; round them as the disk cache does.
+        return (digit, round(scale, 4))
+
+    def get(self, digit, scale):
+        ''' Return the image for (digit, scale), or None '''
+        key = self._key(digit, scale)
+        image = self._images.get(key)
+        if image is not None:
+            self._images.move_to_end(key)
+        return image
+
+    def put(self, digit, scale, image):
+        ''' Add an image, evicting the least recently used ones if the
+        cache is over budget. The new image itself is never evicted. '''
+        key = self._key(digit, scale)
+        if key in self._images:
+            self.size -= self._bytes(self._images.pop(key))
+        self._images[key] = image
+        self.size += self._bytes(image)
+        while self.size > self.budget and len(self._images) > 1:
+            old_key, old = self._images.popitem(last=False)
+            self.size -= self._bytes(old)
+
+    def nearest(self, digit, scale):
+        ''' Return the image for digit at the scale closest to scale, or
+        None; this does not count as a use '''
+        best = None
+        for (d, s), image in self._images.items():
+            if d == digit and (best is None or
+                               abs(s - scale) < abs(best[0] - scale)):
+                best = (s, image)
+        if best is None:
+            return None
+        return best[1]
+
+    def clear(self):
+        ''' Forget every image '''
+        self._images.clear()
+        self.size = 0
+
+    def __len__(self):
+        return len(self._images)
+
+    def _bytes(self, image):
+        return image.get_width() * image.get_height() * 4
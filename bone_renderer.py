@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+#Copyright (c) 2011 Walter Bender
+#Copyright (c) 2012 Ignacio Rodriguez
+#Copyright (c) 2026 agent
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+'''
+
+bone_renderer.py generates the bones, either as SVG (bone_factory) or
+by drawing directly with cairo (draw_bone, cairo_bone_factory). It
+only needs cairo, Pango and GdkPixbuf, not Gtk or Sugar, so it can be
+used without a display.
+
+'''
+
+import gi
+gi.require_version('GdkPixbuf', '2.0')
+gi.require_version('PangoCairo', '1.0')
+from gi.repository import GdkPixbuf
+from gi.repository import Pango, PangoCairo
+import cairo
+
+from napier import bone
+
+BONE_WIDTH = 101
+BONE_HEIGHT = 901
+
+
+def svg_header(scale=1.0):
+    ''' Return standard header for SVG bones '''
+    return '<?xml version="1.0" encoding="UTF-8" standalone="no"?>\
+<!-- Created with Emacs (http://gnu.org/) -->\
+<svg\
+   xmlns:dc="http://purl.org/dc/elements/1.1/"\
+   xmlns:cc="http://creativecommons.org/ns#"\
+   xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"\
+   xmlns:svg="http://www.w3.org/2000/svg"\
+   xmlns="http://www.w3.org/2000/svg"\
+   version="1.1"\
+   width="%f"\
+   height="%f">' % (101 * scale, 901 * scale)
+
+
+def svg_footer():
+    ''' Return standard footer for SVG bones '''
+    return '</svg>\
+'
+
+def svg_single_box(a, scale=1.0):
+    ''' Return standard top-of-column box for SVG bones '''
+    return '    <g>\
+      <rect\
+	  width="%f"\
+	  height="%f"\
+	  x="%f"\
+	  y="%f"\
+	  style="fill:#ffffff;stroke:#000000;stroke-width:%f;stroke-linecap:square;stroke-linejoin:round;stroke-miterlimit:%f;stroke-opacity:1;stroke-dasharray:none" />\
+      <text\
+      style="font-size:%fpx;font-style:normal;font-weight:bold;fill:#000000;fill-opacity:1;stroke:none;font-family:Sans;text-align:center;text-anchor:middle">\
+	<tspan x="%f" y="%f">\
+	  %d\
+	</tspan>\
+      </text>\
+    </g>' % (99 * scale, 99 * scale, scale, scale, 2 * scale,
+             4 * scale, 40 * scale, 55 * scale, 65 * scale, a)
+
+
+def svg_double_box(a, b, y, scale=1.0):
+    ''' Return standard double-digit box for SVG bones '''
+    return '    <g>\
+      <rect\
+	  width="%f"\
+	  height="%f"\
+	  x="%f"\
+	  y="%f"\
+	  style="fill:#ffffff;stroke:none;stroke-width:%f;stroke-linecap:square;stroke-linejoin:round;stroke-miterlimit:%f;stroke-opacity:1;stroke-dasharray:none" />\
+      <line\
+	  x1="%f"\
+	  y1="%f"\
+	  x2="%f"\
+	  y2="%f"\
+	  style="fill:none;stroke:#000000;stroke-width:%f;stroke-linecap:butt;stroke-linejoin:miter;stroke-miterlimit:%f;stroke-opacity:1;stroke-dasharray:none" />\
+      <line\
+	  x1="%f"\
+	  y1="%f"\
+	  x2="%f"\
+	  y2="%f"\
+	  style="fill:none;stroke:#000000;stroke-width:%f;stroke-linecap:butt;stroke-linejoin:miter;stroke-miterlimit:%f;stroke-opacity:1;stroke-dasharray:none" />\
+      <text\
+	  style="font-size:%fpx;font-style:normal;font-weight:bold;fill:#000000;fill-opacity:1;stroke:none;font-family:Sans">\
+	<tspan x="%f" y="%f">\
+	  %d\
+	</tspan>\
+      </text>\
+      <text\
+      style="font-size:%fpx;font-style:normal;font-weight:bold;fill:#000000;fill-opacity:1;stroke:none;font-family:Sans">\
+	<tspan x="%f" y="%f">\
+	  %d\
+	</tspan>\
+      </text>\
+    </g>' % (99 * scale, 99 * scale, scale, y * scale, 2 * scale,
+             4 * scale, scale, (y + 99) * scale, 99 * scale,
+             (y + 1) * scale, 2 * scale, 4 * scale, scale, (y + 1) * scale,
+             99 * scale, (y + 1) * scale, 2 * scale, 4 * scale, 40 * scale,
+             12 * scale, (y + 51) * scale, a, 40 * scale, 54 * scale,
+             (y + 85) * scale, b)
+
+
+def bone_factory(value, scale=1.0):
+    ''' Return the SVG for the bone of a digit '''
+    svg = svg_header(scale=scale)
+    svg += svg_single_box(value, scale=scale)
+    for i, (tens, units) in enumerate(bone(value)):
+        if i > 0:
+            svg += svg_double_box(tens, units, i * 100, scale=scale)
+    return svg + svg_footer()
+
+
+def _cairo_text(cr, value, x, y, scale, center=False):
+    ''' Draw a digit with its baseline at (x, y), as SVG <text> would '''
+    pl = PangoCairo.create_layout(cr)
+    fd = Pango.FontDescription('Sans Bold')
+    fd.set_absolute_size(40 * scale * Pango.SCALE)
+    pl.set_font_description(fd)
+    pl.set_text('%d' % (value), -1)
+    if center:  # text-anchor:middle
+        x -= pl.get_size()[0] / Pango.SCALE / 2.
+    cr.move_to(x, y - pl.get_baseline() / Pango.SCALE)
+    PangoCairo.show_layout(cr, pl)
+
+
+def draw_bone(cr, value, scale=1.0):
+    ''' Draw the same bone as bone_factory onto a cairo context, with its
+    top-left corner at the origin '''
+    cr.save()
+    cr.set_line_width(2 * scale)
+    cr.set_miter_limit(4 * scale)
+
+    # The top-of-column box
+    cr.rectangle(scale, scale, 99 * scale, 99 * scale)
+    cr.set_source_rgb(1, 1, 1)
+    cr.fill_preserve()
+    cr.set_source_rgb(0, 0, 0)
+    cr.set_line_cap(cairo.LINE_CAP_SQUARE)
+    cr.set_line_join(cairo.LINE_JOIN_ROUND)
+    cr.stroke()
+    _cairo_text(cr, value, 55 * scale, 65 * scale, scale, center=True)
+
+    # The double-digit boxes
+    cr.set_line_cap(cairo.LINE_CAP_BUTT)
+    cr.set_line_join(cairo.LINE_JOIN_MITER)
+    for i, (tens, units) in enumerate(bone(value)):
+        if i > 0:
+            y = i * 100
+            cr.rectangle(scale, y * scale, 99 * scale, 99 * scale)
+            cr.set_source_rgb(1, 1, 1)
+            cr.fill()
+            cr.set_source_rgb(0, 0, 0)
+            cr.move_to(scale, (y + 99) * scale)
+            cr.line_to(99 * scale, (y + 1) * scale)
+            cr.move_to(scale, (y + 1) * scale)
+            cr.line_to(99 * scale, (y + 1) * scale)
+            cr.stroke()
+            _cairo_text(cr, tens, 12 * scale, (y + 51) * scale, scale)
+            _cairo_text(cr, units, 54 * scale, (y + 85) * scale, scale)
+    cr.restore()
+
+
+def cairo_bone_factory(value, scale=1.0):
+    ''' Draw a bone straight onto a new cairo surface (no SVG round-trip) '''
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                 int(BONE_WIDTH * scale + 0.5),
+                                 int(BONE_HEIGHT * scale + 0.5))
+    draw_bone(cairo.Context(surface), value, scale=scale)
+    surface.flush()
+    return surface
+
+
+def svg_str_to_pixbuf(svg_string):
+    ''' Load pixbuf from SVG string '''
+    pl = GdkPixbuf.PixbufLoader.new_with_type('svg')
+    pl.write(bytes(svg_string, 'utf-8'))
+    pl.close()
+    pixbuf = pl.get_pixbuf()
+    return pixbuf
+
+
+def load_svg_from_file(file_path, width, height):
+    '''Create a pixbuf from SVG in a file. '''
+    return GdkPixbuf.Pixbuf.new_from_file_at_size(file_path, width, height)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#Copyright (c) 2026 agent
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+'''
+
+lattice.py multiplies a multi-digit multiplicand by a multi-digit
+multiplier the way it is done with Napier's bones: one partial product
+per multiplier digit (read off the bones), which are then shifted and
+added.
+
+Numbers are lists of decimal digits, most significant first. Only the
+sum is kept (the cells of the lattice are read off the two numbers when
+drawn), and it is updated incrementally as digits are appended to
+either number:
+
+    appending v to the multiplicand N:  sum' = 10 * sum + v * M
+    appending d to the multiplier M:    sum' = 10 * sum + N * d
+
+so nothing is ever recomputed from scratch. While there is no
+multiplier there is nothing to update, and many multiplicand digits
+added at once recompute the sum instead. Products of long numbers by a
+single digit come from napier.multiply.
+
+Example usage:
+        lattice = Lattice()
+        for digit in (4, 3, 7):
+            lattice.add_multiplicand_digit(digit)
+        lattice.add_multiplier_digit(2)
+        lattice.add_multiplier_digit(5)
+        napier.to_string(lattice.total)  # '10925'
+
+'''
+
+from napier import multiply
+
+# Below this many digits, plain Python is faster than napier.multiply,
+# which may go through NumPy.
+SHORT = 64
+
+
+def _times(digits, factor):
+    ''' Return digits multiplied by a single digit (as a new list) '''
+    if len(digits) < SHORT:
+        product = []
+        carry = 0
+        for digit in reversed(digits):
+            carry, digit = divmod(factor * digit + carry, 10)
+            product.append(digit)
+        if carry > 0 or len(product) == 0:
+            product.append(carry)
+        product.reverse()
+        return product
+    product = list(bytearray(multiply(digits, factor)))
+    if len(product) > 1 and product[0] == 0:  # no carry out of the top
+        del product[0]
+    return product
+
+
+def _add(total, addend):
+    ''' Add addend to total, in place, aligning their last digits '''
+    if len(addend) > len(total):  # pad once, not one insert per digit
+        total[:0] = [0] * (len(addend) - len(total))
+    carry = 0
+    i = len(total) - 1
+    for digit in reversed(addend):
+        carry, total[i] = divmod(total[i] + digit + carry, 10)
+        i -= 1
+    while carry > 0:  # out of the top of addend
+        if i < 0:
+            total.insert(0, 0)
+            i = 0
+        carry, total[i] = divmod(total[i] + carry, 10)
+        i -= 1
+
+
+class Lattice:
+    ''' The sum of the partial products of multiplicand x multiplier '''
+
+    # Adding this many multiplicand digits or more at once recomputes the
+    # sum instead of extending it one digit at a time.
+    BATCH = 64
+
+    def __init__(self):
+        self.multiplicand = []
+        self.multiplier = []
+        self.total = [0]
+
+    def add_multiplicand_digit(self, value):
+        ''' Append a digit to the multiplicand '''
+        self.multiplicand.append(value)
+        if len(self.multiplier) == 0:  # the sum stays 0
+            return
+        self.total.append(0)
+        _add(self.total, _times(self.multiplier, value))
+
+    def add_multiplicand_digits(self, digits):
+        ''' Append several digits to the multiplicand '''
+        if len(self.multiplier) == 0 or len(digits) < self.BATCH:
+            for value in digits:
+                self.add_multiplicand_digit(value)
+            return
+        self.multiplicand.extend(digits)
+        multiplier = self.multiplier
+        self.multiplier = []
+        self.total = [0]
+        for value in multiplier:
+            self.add_multiplier_digit(value)
+
+    def add_multiplier_digit(self, value):
+        ''' Append a digit to the multiplier; this adds one partial
+        product '''
+        self.multiplier.append(value)
+        self.total.append(0)
+        _add(self.total, _times(self.multiplicand, value))
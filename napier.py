@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+#Copyright (c) 2026 agent
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+'''
+
+napier.py does the arithmetic of Napier's bones: the cells of the
+bones, the diagonal sums read off them and the products they give. It
+needs neither Gtk nor Sugar. If NumPy is installed, whole tables are
+computed as array operations, which is fast enough for multiplicands
+of hundreds of thousands of digits; otherwise plain Python is used.
+
+Numbers are sequences of decimal digits, most significant first: a
+list, bytearray or NumPy array of ints. Tables have one row per factor.
+
+The bone for digit d has, in row f, the tens and units of f x d. To
+multiply N by f, read row f of N's bones: each diagonal sum adds the
+units of one bone to the tens of the bone to its right, and the sums
+are then carried from right to left. N has len(N) + 1 diagonals, and
+no product has more digits than that.
+
+Example usage:
+        digits = [4, 3, 7]
+        tens, units = bone_table(digits)   # 9 rows of 3 cells each
+        diagonal_sums(digits, (7,))        # [[2, 10, 5, 9]]
+        to_string(multiply(digits, 7))     # '3059'
+        [to_string(row) for row in products(digits)]  # '437' ... '3933'
+
+Products keeps the tables for a number that grows one digit at a time,
+updating them instead of computing them again:
+        table = Products()
+        table.append([4, 3])
+        table.append([7])
+        to_string(table.rows[6])           # '3059'
+
+'''
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Set to False to use the plain Python code even if NumPy is installed.
+USE_NUMPY = numpy is not None
+
+FACTORS = (1, 2, 3, 4, 5, 6, 7, 8, 9)
+
+_DIGIT_CHARS = bytes.maketrans(bytes(range(10)), b'0123456789')
+
+
+def bone(value):
+    ''' Return the (tens, units) of the cells of the bone for a digit,
+    for the factors 1 to 9 '''
+    return [divmod(factor * value, 10) for factor in FACTORS]
+
+
+def to_string(digits):
+    ''' Return a sequence of digits as a string, without leading zeros '''
+    return bytes(bytearray(digits)).translate(_DIGIT_CHARS).decode(
+        'ascii').lstrip('0') or '0'
+
+
+def _array(digits):
+    ''' Return digits as a 1-D NumPy array of small ints '''
+    if isinstance(digits, numpy.ndarray):
+        return digits.astype(numpy.int16)
+    return numpy.frombuffer(bytes(bytearray(digits)),
+                            dtype=numpy.uint8).astype(numpy.int16)
+
+
+def bone_table(digits, factors=FACTORS):
+    ''' Return (tens, units): the cells of the bones for digits, with one
+    row per factor and one column per digit '''
+    if USE_NUMPY:
+        cells = numpy.outer(numpy.array(factors, dtype=numpy.int16),
+                            _array(digits))
+        return cells // 10, cells % 10
+    tens = []
+    units = []
+    for factor in factors:
+        row = [factor * d for d in digits]
+        tens.append(bytearray([c // 10 for c in row]))
+        units.append(bytearray([c % 10 for c in row]))
+    return tens, units
+
+
+def diagonal_sums(digits, factors=FACTORS):
+    ''' Return the len(digits) + 1 diagonal sums for each factor, before
+    carrying. Each sum is at most 17. '''
+    tens, units = bone_table(digits, factors)
+    n = len(digits)
+    if USE_NUMPY:
+        sums = numpy.zeros((len(factors), n + 1), dtype=numpy.int16)
+        sums[:, :n] += tens
+        sums[:, 1:] += units
+        return sums
+    table = []
+    for t, u in zip(tens, units):
+        row = bytearray(n + 1)
+        for i in range(n):
+            row[i] += t[i]
+            row[i + 1] += u[i]
+        table.append(row)
+    return table
+
+
+def resolve_carries(sums):
+    ''' Carry each row of diagonal sums from right to left; return the
+    digits of the products, as long as the rows of sums '''
+    if USE_NUMPY:
+        return _resolve_carries_numpy(sums)
+    table = []
+    for row in sums:
+        digits = bytearray(len(row))
+        carry = 0
+        for i in range(len(row) - 1, -1, -1):
+            carry, digits[i] = divmod(row[i] + carry, 10)
+        table.append(digits)
+    return table
+
+
+def _resolve_carries_numpy(sums):
+    ''' Carry-lookahead: resolve every carry at once, with no loop over
+    the digits. '''
+    # Work from the units end. A sum of at least 10 generates a carry, a
+    # sum of 9 passes on the carry it gets and any other sum stops it. So
+    # the carry into a digit is generated by the nearest digit to its
+    # right whose sum is not 9, if there is one.
+    sums = numpy.asarray(sums, dtype=numpy.int16)[:, ::-1]
+    rows, n = sums.shape
+    positions = numpy.broadcast_to(numpy.arange(n), (rows, n))
+    last = numpy.maximum.accumulate(
+        numpy.where(sums != 9, positions, -1), axis=1)
+    # The nearest such digit strictly before each position
+    last = numpy.concatenate(
+        [numpy.full((rows, 1), -1, dtype=last.dtype), last[:, :-1]], axis=1)
+    carries = numpy.take_along_axis(sums >= 10, numpy.maximum(last, 0),
+                                    axis=1) & (last >= 0)
+    return numpy.ascontiguousarray(
+        ((sums + carries) % 10).astype(numpy.uint8)[:, ::-1])
+
+
+def products(digits, factors=FACTORS):
+    ''' Return the products of digits and each factor, one row per
+    factor, each padded to len(digits) + 1 digits '''
+    return resolve_carries(diagonal_sums(digits, factors))
+
+
+def multiply(digits, factor):
+    ''' Return digits x factor, as len(digits) + 1 digits '''
+    return products(digits, (factor,))[0]
+
+
+def _bytearrays(table):
+    ''' Return the rows of a table as bytearrays '''
+    if USE_NUMPY:
+        return [bytearray(numpy.ascontiguousarray(row, dtype=numpy.uint8))
+                for row in table]
+    return [bytearray(row) for row in table]
+
+
+class Products:
+    ''' The diagonal sums and products of a number with each factor,
+    updated as digits are appended to the number '''
+
+    # Appending this many digits or more at once recomputes the tables
+    # with array operations instead.
+    BATCH = 64
+
+    def __init__(self, factors=FACTORS):
+        self.factors = factors
+        self.digits = bytearray()
+        self.sums = [bytearray(1) for factor in factors]
+        self.rows = [bytearray(1) for factor in factors]
+
+    def append(self, digits):
+        ''' Append digits to the number. For each digit v and factor f,
+        f x 10N + v = 10 (f x N) + f x v, so the old product is shifted
+        and one cell added; the carry rarely ripples far. '''
+        self.digits.extend(digits)
+        if len(digits) >= self.BATCH:
+            sums = diagonal_sums(self.digits, self.factors)
+            self.rows = _bytearrays(resolve_carries(sums))
+            self.sums = _bytearrays(sums)
+            return
+        for value in digits:
+            for sums, row, factor in zip(self.sums, self.rows, self.factors):
+                tens, units = divmod(factor * value, 10)
+                sums[-1] += tens
+                sums.append(units)
+                row.append(0)
+                carry = factor * value
+                i = len(row) - 1
+                while carry > 0:
+                    carry, row[i] = divmod(row[i] + carry, 10)
+                    i -= 1
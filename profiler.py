@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+#Copyright (c) 2026 agent
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+'''
+
+profiler.py records frame timing and draw statistics, for finding out
+why the activity feels slow on a particular machine. It is off unless
+a Profiler is attached:
+
+        self._profiler = Profiler('/tmp/napier-profile.log')
+        self._sprites.profiler = self._profiler
+
+Once attached, it records:
+        the time spent in each draw callback (Profiler.frame),
+        the time spent drawing each sprite (called from Sprites),
+        the number of invalidations and the area they cover,
+        the latency of event handlers decorated with @profiled,
+        the time to the first frame, if the activity sets first_frame.
+
+Profiler.draw_hud paints a summary over the canvas, and Profiler.dump
+appends one JSON line per call to the log file, then starts a new
+period.
+
+'''
+
+import json
+import time
+import functools
+from collections import deque
+from contextlib import contextmanager
+
+HUD_WIDTH = 330
+HUD_HEIGHT = 96
+
+
+def profiled(func):
+    ''' Decorator for event handlers of an object with a _profiler '''
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if self._profiler is None:
+            return func(self, *args, **kwargs)
+        with self._profiler.event(func.__name__):
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+class Profiler:
+    ''' A class for collecting frame and event timings '''
+
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        self._start = time.time()
+        self._recent = deque(maxlen=60)  # the last frame times, for the HUD
+        self._last_event = None
+        self.first_frame = None  # seconds from launch to the first frame
+        self._reset()
+
+    def _reset(self):
+        ''' Start a new period '''
+        self._period = time.time()
+        self._frames = []
+        self._sprites = {}  # sprite -> [draws, total time]
+        self._handlers = {}  # name -> [calls, total time, max time]
+        self._inval_calls = 0
+        self._inval_area = 0
+        self._events = 0
+
+    def frame(self, seconds):
+        ''' Record the time taken by one draw callback '''
+        self._frames.append(seconds)
+        self._recent.append(seconds)
+
+    def sprite(self, spr, seconds):
+        ''' Record the time taken to draw one sprite '''
+        entry = self._sprites.get(spr)
+        if entry is None:
+            self._sprites[spr] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+    def inval(self, rect):
+        ''' Record an invalidated rectangle '''
+        self._inval_calls += 1
+        self._inval_area += rect[2] * rect[3]
+
+    @contextmanager
+    def event(self, name):
+        ''' Time an event handler, and the invalidations it makes '''
+        calls, area = self._inval_calls, self._inval_area
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            entry = self._handlers.get(name)
+            if entry is None:
+                self._handlers[name] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+            self._events += 1
+            self._last_event = (name, seconds, self._inval_calls - calls,
+                                self._inval_area - area)
+
+    def summary(self):
+        ''' Return the statistics for the current period '''
+        frames = sorted(self._frames)
+        n = len(frames)
+        slowest = sorted(self._sprites.items(),
+                         key=lambda item: item[1][1] / item[1][0],
+                         reverse=True)[:5]
+        return {
+            'time': round(time.time() - self._start, 3),
+            'period': round(time.time() - self._period, 3),
+            'first_frame_ms': self.first_frame * 1000
+                if self.first_frame is not None else None,
+            'frames': n,
+            'frame_ms_mean': sum(frames) * 1000 / n if n else 0,
+            'frame_ms_p95': frames[int(n * 0.95)] * 1000 if n else 0,
+            'frame_ms_max': frames[-1] * 1000 if n else 0,
+            'handlers': dict(
+                [(name, {'calls': e[0], 'ms_mean': e[1] * 1000 / e[0],
+                         'ms_max': e[2] * 1000})
+                 for name, e in self._handlers.items()]),
+            'inval_calls': self._inval_calls,
+            'inval_area': self._inval_area,
+            'inval_calls_per_event':
+                self._inval_calls / self._events if self._events else 0,
+            'inval_area_per_event':
+                self._inval_area / self._events if self._events else 0,
+            'slowest_sprites': [
+                {'rect': list(spr.rect), 'draws': e[0],
+                 'ms_mean': e[1] * 1000 / e[0]} for spr, e in slowest],
+        }
+
+    def dump(self):
+        ''' Append the statistics to the log file and start a new period.
+        Returns True, so it can be used as a GLib timeout callback. '''
+        if self.log_path is not None:
+            try:
+                with open(self.log_path, 'a') as fd:
+                    fd.write(json.dumps(self.summary()) + '\n')
+            except OSError as e:
+                print('profiler: cannot write %s (%s)' % (self.log_path, e))
+        self._reset()
+        return True
+
+    def hud_rect(self):
+        ''' The area covered by the HUD '''
+        return (0, 0, HUD_WIDTH, HUD_HEIGHT)
+
+    def draw_hud(self, cr):
+        ''' Paint a summary of the recent frames over the canvas '''
+        lines = []
+        if len(self._recent) > 0:
+            mean = sum(self._recent) * 1000 / len(self._recent)
+            lines.append('frame: %.1f ms mean, %.1f ms max' %
+                         (mean, max(self._recent) * 1000))
+        else:
+            lines.append('frame: -')
+        lines.append('frames this period: %d' % (len(self._frames)))
+        lines.append('invals: %d (%d px)' % (self._inval_calls,
+                                             self._inval_area))
+        if self._last_event is not None:
+            lines.append('%s: %.1f ms' % (self._last_event[0],
+                                          self._last_event[1] * 1000))
+            lines.append('  %d invals, %d px' % (self._last_event[2],
+                                                 self._last_event[3]))
+        cr.save()
+        cr.rectangle(*self.hud_rect())
+        cr.set_source_rgba(0, 0, 0, 0.7)
+        cr.fill()
+        cr.set_source_rgb(0, 1, 0)
+        cr.select_font_face('Monospace')
+        cr.set_font_size(13)
+        for i, line in enumerate(lines):
+            cr.move_to(6, 17 + i * 17)
+            cr.show_text(line)
+        cr.restore()
@@ -27,10 +27,13 @@ sprites.py is a simple sprites library for managing graphics objects,
 'sprites', on a Gtk.DrawingArea. It manages multiple sprites with
 methods such as move, hide, set_layer, etc.
 
-There are two classes:
+There are five classes:
 
 class Sprites maintains a collection of sprites
 class Sprite manages individual sprites within the collection.
+class Atlas packs many images into a single cairo surface.
+class ScaledImage draws another image at a different size.
+class SpritePool shows and hides a group of look-alike sprites.
 
 Example usage:
         # Import the classes into your program.
@@ -66,6 +69,25 @@ Example usage:
         # In your activity's do_expose_event, put in a call to redraw_sprites
         self.sprites.redraw_sprites(event.area, cairo_context)
 
+        # Sprites in layers up to 100 rarely change: draw them once into
+        # an offscreen cache and only draw the layers above every frame.
+        self.sprite_list.set_static_layer(100)
+
+        # Images that are drawn together can share one source surface.
+        atlas = sprites.Atlas(width, height)
+        my_image = atlas.add(my_pixbuf)
+        my_sprite.set_image(my_image)
+
+        # Hit test against the opaque pixels, not the bounding box.
+        my_sprite.set_hit_mask()
+
+        # Show a marker at each of a list of positions, and no others.
+        pool = sprites.SpritePool(self.sprite_list, marker_pixbuf, 200)
+        pool.show([(x1, y1), (x2, y2)])
+
+        # Stretch an image (e.g. while a better one is being rendered).
+        my_sprite.set_image(sprites.ScaledImage(my_image, width, height))
+
 # method for converting SVG to a gtk pixbuf
 def svg_str_to_pixbuf(svg_string):
     pl = GdkPixbuf.PixbufLoader('svg')
@@ -76,11 +98,33 @@ def svg_str_to_pixbuf(svg_string):
 
 '''
 
+import sys
+import time
+import weakref
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from bisect import bisect_left, bisect_right
+
 import gi
 from gi.repository import Gtk, GdkPixbuf, Gdk
 from gi.repository import Pango, PangoCairo
 import cairo
 
+GRID_CELL = 128  # size of a spatial-index cell, in pixels
+LAYOUT_CACHE_SIZE = 256  # number of Pango layouts kept for labels
+# scale, rescale, horiz_align, vert_align, x_pos, y_pos
+LABEL_DEFAULTS = (12, True, 'center', 'middle', None, None)
+# A pixel at least this opaque counts as part of a sprite in hit masks.
+HIT_ALPHA = 128
+_HIT_TABLE = bytes([1 if a >= HIT_ALPHA else 0 for a in range(256)])
+# The byte offsets of red, green, blue and alpha in a cairo ARGB32 pixel,
+# which is stored as a native-endian 32-bit word.
+if sys.byteorder == 'little':
+    _ARGB32 = (2, 1, 0, 3)
+else:
+    _ARGB32 = (1, 2, 3, 0)
+
 
 class Sprites:
     ''' A class for the list of sprites and everything they share in common '''
@@ -89,12 +133,138 @@ class Sprites:
         ''' Initialize an empty array of sprites '''
         self.cr = None
         self.widget = widget
-        self.list = []
+        self.list = []  # sorted by (layer, sequence number)
+        self._keys = []  # the (layer, sequence number) of each sprite
+        self._sequence = 0
+        self.drawn = 0  # sprites drawn/culled by the last redraw_sprites
+        self.culled = 0
+        self.total_drawn = 0
+        self.total_culled = 0
+        self.cached = 0  # sprites redrawn into the static cache, likewise
+        self.total_cached = 0
+        # Spatial index: (column, row) -> set of sprites overlapping the cell
+        self._grid = {}
+        # Dirty rectangles gathered while a batch is open
+        self._batch_depth = 0
+        self._dirty = cairo.Region()
+        # Label layouts: (text, font, size, width) -> [layout, serial, w, h]
+        self._pango_context = None
+        self._layouts = OrderedDict()
+        self.profiler = None  # see profiler.py
+        # pixbuf -> cairo surface, shared by every sprite using the pixbuf
+        self._surfaces = weakref.WeakKeyDictionary()
+        # image -> its hit mask
+        self._masks = weakref.WeakKeyDictionary()
+        # Offscreen copy of the static layers, and the parts of it that
+        # are out of date
+        self.static_layer = None
+        self._static = None
+        self._static_dirty = cairo.Region()
 
     def set_cairo_context(self, cr):
         ''' Cairo context may be set or reset after __init__ '''
         self.cr = cr
 
+    def set_static_layer(self, layer):
+        ''' Composite the sprites in layers up to and including layer once,
+        into an offscreen surface, and redraw only the layers above it on
+        every frame. None turns this off. '''
+        self.static_layer = layer
+        self._static = None
+
+    def is_static(self, layer):
+        ''' Is a layer drawn from the static cache? '''
+        return self.static_layer is not None and layer <= self.static_layer
+
+    def surface_from_pixbuf(self, pixbuf):
+        ''' Convert a pixbuf to a cairo surface once and remember it '''
+        surface = self._surfaces.get(pixbuf)
+        if surface is None:
+            # Match the window's native format when it is available.
+            surface = Gdk.cairo_surface_create_from_pixbuf(
+                pixbuf, 1, self.widget.get_window())
+            self._surfaces[pixbuf] = surface
+        return surface
+
+    def get_mask(self, image):
+        ''' Return the hit mask of an image (one byte per pixel, 1 where
+        it is opaque enough), computed once per image. None means the
+        image has no mask and its whole rectangle counts. '''
+        try:
+            mask = self._masks.get(image)
+        except TypeError:  # cannot be weakly referenced, so not cached
+            return _alpha_mask(self, image)
+        if mask is None:
+            mask = _alpha_mask(self, image)
+            if mask is not None:
+                self._masks[image] = mask
+        return mask
+
+    def invalidate(self, rect, static=False):
+        ''' Queue a redraw of (x, y, w, h), or hold it until the end of the
+        current batch. static means that a static sprite changed there, so
+        the cache must be redrawn too. '''
+        if rect[2] <= 0 or rect[3] <= 0:
+            return
+        if self.profiler is not None:
+            self.profiler.inval(rect)
+        if static and self._static is not None:
+            self._static_dirty.union(cairo.RectangleInt(*rect))
+        if self._batch_depth > 0:
+            self._dirty.union(cairo.RectangleInt(*rect))
+        else:
+            self.widget.queue_draw_area(*rect)
+
+    @contextmanager
+    def batch(self):
+        ''' Merge the invalidations made inside a with-block into a single
+        queue_draw_region when the (outermost) block ends:
+
+            with sprites.batch():
+                spr1.move(...)
+                spr2.set_shape(...)
+        '''
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and not self._dirty.is_empty():
+                self.widget.queue_draw_region(self._dirty)
+                self._dirty = cairo.Region()
+
+    def get_layout(self, cr, text, font, size, width=None):
+        ''' Return a cached (layout, width, height) for a label. If width
+        is given, the text is ellipsized at the start to fit in it. '''
+        # All the layouts share one context. Pango re-flows them (and
+        # bumps the serial) only if the font options or scale change.
+        if self._pango_context is None:
+            self._pango_context = PangoCairo.create_context(cr)
+        else:
+            PangoCairo.update_context(cr, self._pango_context)
+        serial = self._pango_context.get_serial()
+        key = (text, font, size, width)
+        entry = self._layouts.get(key)
+        if entry is None:
+            pl = Pango.Layout.new(self._pango_context)
+            pl.set_text(text, -1)
+            fd = Pango.FontDescription(font)
+            fd.set_size(size)
+            pl.set_font_description(fd)
+            if width is not None:
+                pl.set_width(int(width * Pango.SCALE))
+                pl.set_ellipsize(Pango.EllipsizeMode.START)
+            entry = [pl, None, 0, 0]
+            self._layouts[key] = entry
+            if len(self._layouts) > LAYOUT_CACHE_SIZE:
+                self._layouts.popitem(last=False)  # least recently used
+        else:
+            self._layouts.move_to_end(key)
+        if entry[1] != serial:
+            w, h = entry[0].get_size()
+            entry[1:] = [serial, w / Pango.SCALE, h / Pango.SCALE]
+        return entry[0], entry[2], entry[3]
+
     def get_sprite(self, i):
         ''' Return a sprint from the array '''
         if i < 0 or i > len(self.list)-1:
@@ -107,34 +277,82 @@ class Sprites:
         return(len(self.list))
 
     def append_to_list(self, spr):
-        ''' Append a new sprite to the end of the list. '''
-        self.list.append(spr)
+        ''' Add a sprite on top of the others in its layer. '''
+        self._sequence += 1
+        spr._key = (spr.layer, self._sequence)
+        i = bisect_right(self._keys, spr._key)
+        self._keys.insert(i, spr._key)
+        self.list.insert(i, spr)
+        self._add_to_index(spr)
+        self._static_changed(spr)
 
     def insert_in_list(self, spr, i):
-        ''' Insert a sprite at position i. '''
-        if i < 0:
-            self.list.insert(0, spr)
-        elif i > len(self.list) - 1:
-            self.list.append(spr)
-        else:
-            self.list.insert(i, spr)
+        ''' Add a sprite to the list. The position is determined by its
+        layer, so i is ignored. '''
+        self.append_to_list(spr)
 
     def remove_from_list(self, spr):
         ''' Remove a sprite from the list. '''
-        if spr in self.list:
-            self.list.remove(spr)
+        if spr._key is None:
+            return
+        i = bisect_left(self._keys, spr._key)
+        del self._keys[i]
+        del self.list[i]
+        spr._key = None
+        self._remove_from_index(spr)
+        self._static_changed(spr)
+
+    def _static_changed(self, spr):
+        ''' Mark the static cache out of date where a sprite was added or
+        removed, if it is in a static layer. The area is redrawn too: a
+        full expose only blits the cache, so it would not show there. '''
+        if self._static is not None and self.is_static(spr.layer):
+            self.invalidate(tuple(spr.rect), static=True)
+
+    def _add_to_index(self, spr):
+        ''' Add a sprite to every grid cell its rectangle overlaps '''
+        x, y, w, h = spr.rect
+        spr._cells = (x // GRID_CELL, y // GRID_CELL,
+                      (x + w) // GRID_CELL, (y + h) // GRID_CELL)
+        for col in range(spr._cells[0], spr._cells[2] + 1):
+            for row in range(spr._cells[1], spr._cells[3] + 1):
+                self._grid.setdefault((col, row), set()).add(spr)
+
+    def _remove_from_index(self, spr):
+        ''' Remove a sprite from the grid cells it was in '''
+        if spr._cells is None:
+            return
+        for col in range(spr._cells[0], spr._cells[2] + 1):
+            for row in range(spr._cells[1], spr._cells[3] + 1):
+                cell = self._grid[(col, row)]
+                cell.discard(spr)
+                if len(cell) == 0:
+                    del self._grid[(col, row)]
+        spr._cells = None
+
+    def update_index(self, spr):
+        ''' Re-index a sprite after its rectangle changes '''
+        if spr._cells is None:  # not in the list
+            return
+        self._remove_from_index(spr)
+        self._add_to_index(spr)
 
     def find_sprite(self, pos):
         ''' Search based on (x, y) position. Return the 'top/first' one. '''
-        list = self.list[:]
-        list.reverse()
-        for spr in list:
-            if spr.hit(pos):
-                return spr
-        return None
+        cell = self._grid.get((int(pos[0]) // GRID_CELL,
+                               int(pos[1]) // GRID_CELL))
+        if cell is None:
+            return None
+        top = None
+        for spr in cell:
+            if spr.visible and spr.hit(pos):
+                if top is None or spr._key > top._key:
+                    top = spr
+        return top
 
     def redraw_sprites(self, area=None, cr=None):
-        ''' Redraw the sprites that intersect area. '''
+        ''' Redraw the sprites that intersect area, or the clip region of
+        the Cairo context if no area is given. '''
         # I think I need to do this to save Cairo some work
         if cr is None:
             cr = self.cr
@@ -143,40 +361,306 @@ class Sprites:
         if cr is None:
             print('sprites.redraw_sprites: no Cairo context')
             return
-        for spr in self.list:
-            if area == None:
-                spr.draw(cr=cr)
-            else:
-                intersection = spr.rect.intersect(area)
-                if intersection.width > 0 or intersection.height > 0:
+        if area is None:
+            rects = _clip_rectangles(cr)
+        elif hasattr(area, 'width'):  # Gdk.Rectangle
+            rects = [(area.x, area.y, area.width, area.height)]
+        else:
+            rects = [tuple(area)]
+        # Count drawn vs. culled sprites so the savings can be checked.
+        # Sprites redrawn into the static cache are counted apart.
+        self.cached = 0
+        if self.static_layer is None:
+            self.drawn, self.culled = self._draw_list(cr, self.list, rects)
+        else:
+            split = bisect_right(self._keys, (self.static_layer,
+                                              float('inf')))
+            self._update_static(cr, split)
+            cr.set_source_surface(self._static, 0, 0)
+            for x, y, w, h in rects:
+                cr.rectangle(x, y, w, h)
+            cr.fill()
+            self.drawn, self.culled = self._draw_list(cr, self.list[split:],
+                                                      rects)
+        self.total_drawn += self.drawn
+        self.total_culled += self.culled
+        self.total_cached += self.cached
+
+    def _draw_list(self, cr, sprites, rects):
+        ''' Draw the sprites that intersect any of rects; return how many
+        were drawn and how many culled '''
+        drawn = 0
+        culled = 0
+        for spr in sprites:
+            if spr.visible and spr.intersects(rects):
+                if self.profiler is None:
                     spr.draw(cr=cr)
+                else:
+                    start = time.perf_counter()
+                    spr.draw(cr=cr)
+                    self.profiler.sprite(spr, time.perf_counter() - start)
+                drawn += 1
+            else:
+                culled += 1
+        return drawn, culled
+
+    def _update_static(self, cr, split):
+        ''' Redraw the out-of-date parts of the static cache, from the
+        first split sprites in the list '''
+        w = self.widget.get_allocated_width()
+        h = self.widget.get_allocated_height()
+        if self._static is None or self._static.get_width() != w or \
+           self._static.get_height() != h:
+            # Similar to the target, so blitting it needs no conversion.
+            self._static = cr.get_target().create_similar(
+                cairo.CONTENT_COLOR_ALPHA, w, h)
+            self._static_dirty = cairo.Region(cairo.RectangleInt(0, 0, w, h))
+        if self._static_dirty.is_empty():
+            return
+        rects = []
+        for i in range(self._static_dirty.num_rectangles()):
+            r = self._static_dirty.get_rectangle(i)
+            rects.append((r.x, r.y, r.width, r.height))
+        self._static_dirty = cairo.Region()
+        scr = cairo.Context(self._static)
+        for x, y, rw, rh in rects:
+            scr.rectangle(x, y, rw, rh)
+        scr.clip()
+        scr.set_operator(cairo.OPERATOR_CLEAR)
+        scr.paint()
+        scr.set_operator(cairo.OPERATOR_OVER)
+        self.cached = self._draw_list(scr, self.list[:split], rects)[0]
+
+
+def _clip_rectangles(cr):
+    ''' Return the clip region of a Cairo context as (x, y, w, h) tuples '''
+    try:
+        return [tuple(r) for r in cr.copy_clip_rectangle_list()]
+    except cairo.Error:  # the clip is not representable as rectangles
+        x1, y1, x2, y2 = cr.clip_extents()
+        return [(x1, y1, x2 - x1, y2 - y1)]
+
+
+def _surface_data(image):
+    ''' Return (data, stride, x, y, format) to read the pixels of an
+    image surface or AtlasImage in place, or None for other images '''
+    if isinstance(image, AtlasImage):
+        surface, x, y = image.atlas.surface, image.x, image.y
+    elif isinstance(image, cairo.ImageSurface):
+        surface, x, y = image, 0, 0
+    else:
+        return None
+    surface.flush()  # finish any drawing before reading the memory
+    return (surface.get_data(), surface.get_stride(), x, y,
+            surface.get_format())
+
+
+def _alpha_mask(sprites, image):
+    ''' Compute the hit mask of an image, row by row '''
+    w, h = image.get_width(), image.get_height()
+    if isinstance(image, GdkPixbuf.Pixbuf):
+        # Read the surface it is drawn from; it has the same pixels.
+        image = sprites.surface_from_pixbuf(image)
+    source = _surface_data(image)
+    if source is None or source[4] != cairo.FORMAT_ARGB32:
+        return None
+    data, stride, x0, y0, fmt = source
+    rows = []
+    for y in range(y0, y0 + h):
+        start = y * stride + x0 * 4
+        rows.append(bytes(data[start:start + w * 4])[_ARGB32[3]::4])
+    return b''.join(rows).translate(_HIT_TABLE)
+
+
+def _draw_scaled(cr, img, x, y):
+    ''' Draw a ScaledImage with its top-left corner at (x, y) '''
+    source = img.image
+    w, h = source.get_width(), source.get_height()
+    cr.save()
+    cr.translate(x, y)
+    cr.scale(img.width / w, img.height / h)
+    if isinstance(source, AtlasImage):
+        source.atlas.pattern.set_matrix(
+            cairo.Matrix(x0=source.x, y0=source.y))
+        cr.set_source(source.atlas.pattern)
+    elif isinstance(source, GdkPixbuf.Pixbuf):
+        Gdk.cairo_set_source_pixbuf(cr, source, 0, 0)
+    else:
+        cr.set_source_surface(source, 0, 0)
+    cr.rectangle(0, 0, w, h)
+    cr.fill()
+    cr.restore()
+
+
+class AtlasImage:
+    ''' A sub-rectangle of an Atlas, usable anywhere a pixbuf is '''
+
+    __slots__ = ('atlas', 'x', 'y', 'width', 'height', '__weakref__')
+
+    def __init__(self, atlas, x, y, width, height):
+        self.atlas = atlas
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+    def get_width(self):
+        return self.width
+
+    def get_height(self):
+        return self.height
+
+
+class Atlas:
+    ''' A class for packing images into rows ('shelves') of one surface '''
+
+    def __init__(self, width=2048, height=0):
+        ''' Initialize an empty atlas; it grows downward as needed '''
+        self.surface = None
+        self.pattern = None
+        self._width = width
+        self._height = 0
+        self._x = 0  # next free spot on the current shelf
+        self._y = 0  # top of the current shelf
+        self._shelf_height = 0
+        if height > 0:
+            self._resize(height)
+
+    def _resize(self, height):
+        ''' Grow the surface, copying what has been packed so far '''
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, self._width, height)
+        if self.surface is not None:
+            cr = cairo.Context(surface)
+            cr.set_source_surface(self.surface, 0, 0)
+            cr.paint()
+        self.surface = surface
+        self.pattern = cairo.SurfacePattern(surface)
+        self._height = height
+
+    def add(self, image):
+        ''' Copy a pixbuf or surface into the atlas; return an AtlasImage '''
+        w, h = image.get_width(), image.get_height()
+        if w > self._width:
+            print('atlas.add: image too wide (%d > %d)' % (w, self._width))
+            return image
+        if self._x + w > self._width:  # start a new shelf
+            self._y += self._shelf_height
+            self._x = 0
+            self._shelf_height = 0
+        if self._y + h > self._height:
+            self._resize(self._y + h)
+        x, y = self._x, self._y
+        cr = cairo.Context(self.surface)
+        if isinstance(image, GdkPixbuf.Pixbuf):
+            Gdk.cairo_set_source_pixbuf(cr, image, x, y)
+        else:
+            cr.set_source_surface(image, x, y)
+        cr.rectangle(x, y, w, h)
+        cr.set_operator(cairo.OPERATOR_SOURCE)
+        cr.fill()
+        self._x += w
+        if h > self._shelf_height:
+            self._shelf_height = h
+        return AtlasImage(self, x, y, w, h)
+
+
+class ScaledImage:
+    ''' Another image (pixbuf, surface or AtlasImage) drawn at a given
+    size. Cheap to draw, but blurry; meant to stand in for an image that
+    has not been rendered at the right size yet. '''
+
+    __slots__ = ('image', 'width', 'height', '__weakref__')
+
+    def __init__(self, image, width, height):
+        self.image = image
+        self.width = width
+        self.height = height
+
+    def get_width(self):
+        return self.width
+
+    def get_height(self):
+        return self.height
+
+
+class SpritePool:
+    ''' A class for a group of sprites that share an image, such as
+    markers, of which a varying number are shown '''
+
+    def __init__(self, sprites, image, layer=None, mask=False):
+        self._sprites = sprites
+        self.image = image
+        self.layer = layer
+        self.mask = mask  # hit test the sprites pixel by pixel
+        self.sprites = []  # the first 'shown' of them are visible
+        self.shown = 0
+
+    def show(self, positions):
+        ''' Show one sprite at each (x, y) position and hide the rest.
+        Only the sprites that move, appear or disappear are invalidated. '''
+        n = 0
+        for n, pos in enumerate(positions, 1):
+            if n > len(self.sprites):
+                spr = Sprite(self._sprites, pos[0], pos[1], self.image)
+                if self.mask:
+                    spr.set_hit_mask()
+                if self.layer is not None:
+                    spr.set_layer(self.layer)  # this invalidates it too
+                else:
+                    spr.inval()
+                self.sprites.append(spr)
+                continue
+            spr = self.sprites[n - 1]
+            if spr.rect[0] != int(pos[0]) or spr.rect[1] != int(pos[1]):
+                spr.move(pos)
+            spr.restore()
+        for spr in self.sprites[n:self.shown]:
+            spr.hide()
+        self.shown = n
+
+    def hide(self):
+        ''' Hide every sprite in the pool '''
+        self.show(())
+
+    def set_image(self, image):
+        ''' Change the image of every sprite in the pool '''
+        self.image = image
+        for spr in self.sprites:
+            spr.set_shape(image)
 
 
 class Sprite:
     ''' A class for the individual sprites '''
 
+    # Sprites are created by the thousand on big worksheets, so avoid a
+    # per-instance dict. Per-label attributes are only allocated for
+    # sprites that actually have labels.
+    __slots__ = ('_sprites', 'save_xy', 'rect', '_label_attrs', '_font',
+                 '_bold', '_italic', '_color', '_margins', 'layer', 'labels',
+                 'images', '_surfaces', '_offsets', 'type', '_cells', '_key',
+                 'visible', '_masks', '__weakref__')
+
     def __init__(self, sprites, x, y, image):
         ''' Initialize an individual sprite '''
         self._sprites = sprites
         self.save_xy = (x, y)  # remember initial (x, y) position
-        self.rect = [int(x), int(y), 0, 0]
-        self._scale = [12]
-        self._rescale = [True]
-        self._horiz_align = ["center"]
-        self._vert_align = ["middle"]
-        self._x_pos = [None]
-        self._y_pos = [None]
-        self._fd = None
+        self.rect = array('i', (int(x), int(y), 0, 0))
+        self._label_attrs = []  # one list of LABEL_DEFAULTS per label
+        self._font = None
         self._bold = False
         self._italic = False
         self._color = None
-        self._margins = [0, 0, 0, 0]
+        self._margins = (0, 0, 0, 0)
         self.layer = 100
         self.labels = []
         self.images = []
-        self._dx = []  # image offsets
-        self._dy = []
+        self._surfaces = []  # cairo surfaces for pixbuf images
+        self._offsets = []  # (dx, dy) of each image
         self.type = None
+        self._cells = None  # grid cells in the spatial index
+        self._key = None  # (layer, sequence number) while in the list
+        self.visible = True
+        self._masks = None  # hit masks of the images, if enabled
         self.set_image(image)
         self._sprites.append_to_list(self)
 
@@ -184,29 +668,46 @@ class Sprite:
         ''' Add an image to the sprite. '''
         while len(self.images) < i + 1:
             self.images.append(None)
-            self._dx.append(0)
-            self._dy.append(0)
+            self._surfaces.append(None)
+            self._offsets.append((0, 0))
         self.images[i] = image
-        self._dx[i] = dx
-        self._dy[i] = dy
+        if isinstance(image, GdkPixbuf.Pixbuf):
+            self._surfaces[i] = self._sprites.surface_from_pixbuf(image)
+        else:
+            self._surfaces[i] = None
+        self._offsets[i] = (dx, dy)
+        if self._masks is not None:
+            while len(self._masks) < i + 1:
+                self._masks.append(None)
+            self._masks[i] = self._sprites.get_mask(image)
         if hasattr(self.images[i], 'get_width'):
             w = self.images[i].get_width()
             h = self.images[i].get_height()
         else:
             w, h = self.images[i].get_size()
         if i == 0:  # Always reset width and height when base image changes.
-            self.rect[2] = w + dx
-            self.rect[3] = h + dy
+            self.rect[2] = int(w + dx)
+            self.rect[3] = int(h + dy)
         else:
             if w + dx > self.rect[2]:
-                self.rect[2] = w + dx
+                self.rect[2] = int(w + dx)
             if h + dy > self.rect[3]:
-                self.rect[3] = h + dy
+                self.rect[3] = int(h + dy)
+        self._sprites.update_index(self)
+
+    def set_hit_mask(self, enabled=True):
+        ''' Hit test against the opaque pixels of the images, rather than
+        the bounding box. The masks are computed once per image. '''
+        if enabled:
+            self._masks = [self._sprites.get_mask(img) for img in self.images]
+        else:
+            self._masks = None
 
     def move(self, pos):
         ''' Move to new (x, y) position '''
         self.inval()
         self.rect[0], self.rect[1] = int(pos[0]), int(pos[1])
+        self._sprites.update_index(self)
         self.inval()
 
     def move_relative(self, pos):
@@ -214,6 +715,7 @@ class Sprite:
         self.inval()
         self.rect[0] += int(pos[0])
         self.rect[1] += int(pos[1])
+        self._sprites.update_index(self)
         self.inval()
 
     def get_xy(self):
@@ -236,14 +738,12 @@ class Sprite:
 
     def set_layer(self, layer=None):
         ''' Set the layer for a sprite '''
+        if layer is not None and layer != self.layer and \
+           self._key is not None:
+            self.inval()  # where it was, e.g. in the static cache
         self._sprites.remove_from_list(self)
         if layer is not None:
             self.layer = layer
-        for i in range(self._sprites.length_of_list()):
-            if self.layer < self._sprites.get_sprite(i).layer:
-                self._sprites.insert_in_list(self, i)
-                self.inval()
-                return
         self._sprites.append_to_list(self)
         self.inval()
 
@@ -259,26 +759,25 @@ class Sprite:
 
     def set_margins(self, l=0, t=0, r=0, b=0):
         ''' Set the margins for drawing the label '''
-        self._margins = [l, t, r, b]
+        self._margins = (l, t, r, b)
 
     def _extend_labels_array(self, i):
         ''' Append to the labels attribute list '''
-        if self._fd is None:
+        if self._font is None:
             self.set_font('Sans')
         if self._color is None:
             self._color = (0., 0., 0.)
         while len(self.labels) < i + 1:
             self.labels.append(" ")
-            self._scale.append(self._scale[0])
-            self._rescale.append(self._rescale[0])
-            self._horiz_align.append(self._horiz_align[0])
-            self._vert_align.append(self._vert_align[0])
-            self._x_pos.append(self._x_pos[0])
-            self._y_pos.append(self._y_pos[0])
+            # New labels inherit the attributes of the first one.
+            if len(self._label_attrs) > 0:
+                self._label_attrs.append(list(self._label_attrs[0]))
+            else:
+                self._label_attrs.append(list(LABEL_DEFAULTS))
 
     def set_font(self, font):
         ''' Set the font for a label '''
-        self._fd = Pango.FontDescription(font)
+        self._font = font
 
     def set_label_color(self, rgb):
         ''' Set the font color for a label '''
@@ -299,29 +798,35 @@ class Sprite:
                              vert_align="middle", x_pos=None, y_pos=None, i=0):
         ''' Set the various label attributes '''
         self._extend_labels_array(i)
-        self._scale[i] = scale
-        self._rescale[i] = rescale
-        self._horiz_align[i] = horiz_align
-        self._vert_align[i] = vert_align
-        self._x_pos[i] = x_pos
-        self._y_pos[i] = y_pos
+        self._label_attrs[i] = [scale, rescale, horiz_align, vert_align,
+                                x_pos, y_pos]
 
     def hide(self):
-        ''' Hide a sprite '''
-        self.inval()
-        self._sprites.remove_from_list(self)
+        ''' Hide a sprite. It keeps its place in the list, but is not
+        drawn or hit. '''
+        if self.visible:
+            self.inval()
+            self.visible = False
 
     def restore(self):
         ''' Restore a hidden sprite '''
-        self.set_layer()
+        if not self.visible:
+            self.visible = True
+            self.inval()
+
+    def remove(self):
+        ''' Take a sprite out of the list for good (set_layer puts it back) '''
+        self.inval()
+        self._sprites.remove_from_list(self)
 
     def inval(self):
         ''' Invalidate a region for gtk '''
+        if not self.visible:  # nothing to redraw
+            return
         # self._sprites.window.invalidate_rect(self.rect, False)
-        self._sprites.widget.queue_draw_area(self.rect[0],
-                                             self.rect[1],
-                                             self.rect[2],
-                                             self.rect[3])
+        self._sprites.invalidate((self.rect[0], self.rect[1],
+                                  self.rect[2], self.rect[3]),
+                                 self._sprites.is_static(self.layer))
 
     def draw(self, cr=None):
         ''' Draw the sprite (and label) '''
@@ -331,23 +836,26 @@ class Sprite:
             print('sprite.draw: no Cairo context.')
             return
         for i, img in enumerate(self.images):
-            if isinstance(img, GdkPixbuf.Pixbuf):
-                Gdk.cairo_set_source_pixbuf(cr, img,
-                                            self.rect[0] + self._dx[i],
-                                            self.rect[1] + self._dy[i])
-                cr.rectangle(self.rect[0] + self._dx[i],
-                             self.rect[1] + self._dy[i],
-                             self.rect[2],
-                             self.rect[3])
+            x = self.rect[0] + self._offsets[i][0]
+            y = self.rect[1] + self._offsets[i][1]
+            if isinstance(img, GdkPixbuf.Pixbuf) or \
+               isinstance(img, cairo.ImageSurface):
+                # Pixbufs were converted to surfaces once, in set_image.
+                if self._surfaces[i] is not None:
+                    img = self._surfaces[i]
+                cr.set_source_surface(img, x, y)
+                cr.rectangle(x, y, self.rect[2], self.rect[3])
                 cr.fill()
-            elif type(img) == cairo.ImageSurface:
-                cr.set_source_surface(img, self.rect[0] + self._dx[i],
-                                      self.rect[1] + self._dy[i])
-                cr.rectangle(self.rect[0] + self._dx[i],
-                             self.rect[1] + self._dy[i],
-                             self.rect[2],
-                             self.rect[3])
+            elif isinstance(img, AtlasImage):
+                # Every image in the atlas shares one source pattern; only
+                # its offset changes from sprite to sprite.
+                img.atlas.pattern.set_matrix(
+                    cairo.Matrix(x0=img.x - x, y0=img.y - y))
+                cr.set_source(img.atlas.pattern)
+                cr.rectangle(x, y, img.width, img.height)
                 cr.fill()
+            elif isinstance(img, ScaledImage):
+                _draw_scaled(cr, img, x, y)
             else:
                 print('sprite.draw: source not a pixbuf (%s)' % (type(img)))
         if len(self.labels) > 0:
@@ -364,7 +872,27 @@ class Sprite:
             return False
         if y > self.rect[1] + self.rect[3]:
             return False
-        return True
+        if self._masks is None:
+            return True
+        # A pixel lookup in each image's mask
+        for i, mask in enumerate(self._masks):
+            if mask is None:
+                return True
+            w = self.images[i].get_width()
+            ix = int(x) - self.rect[0] - self._offsets[i][0]
+            iy = int(y) - self.rect[1] - self._offsets[i][1]
+            if 0 <= ix < w and 0 <= iy < self.images[i].get_height() and \
+               mask[iy * w + ix]:
+                return True
+        return False
+
+    def intersects(self, rects):
+        ''' Does the sprite overlap any of a list of (x, y, w, h)? '''
+        x, y, w, h = self.rect
+        for rx, ry, rw, rh in rects:
+            if x < rx + rw and rx < x + w and y < ry + rh and ry < y + h:
+                return True
+        return False
 
     def draw_label(self, cr):
         ''' Draw the label based on its attributes '''
@@ -373,47 +901,37 @@ class Sprite:
             my_width = 0
         my_height = self.rect[3] - self._margins[1] - self._margins[3]
         for i in range(len(self.labels)):
-            pl = PangoCairo.create_layout(cr)
-            pl.set_text(str(self.labels[i]), -1)
-            self._fd.set_size(int(self._scale[i] * Pango.SCALE))
-            pl.set_font_description(self._fd)
-            w = pl.get_size()[0] / Pango.SCALE
+            scale, rescale, horiz_align, vert_align, x_pos, y_pos = \
+                self._label_attrs[i]
+            text = str(self.labels[i])
+            size = int(scale * Pango.SCALE)
+            pl, w, h = self._sprites.get_layout(cr, text, self._font, size)
             if w > my_width:
-                if self._rescale[i]:
-                    self._fd.set_size(
-                            int(self._scale[i] * Pango.SCALE * my_width / w))
-                    pl.set_font_description(self._fd)
-                    w = pl.get_size()[0] / Pango.SCALE
+                if rescale:
+                    pl, w, h = self._sprites.get_layout(
+                        cr, text, self._font, int(size * my_width / w))
                 else:
-                    j = len(self.labels[i]) - 1
-                    while(w > my_width and j > 0):
-                        pl.set_text(
-                            "…" + self.labels[i][len(self.labels[i]) - j:], -1)
-                        self._fd.set_size(int(self._scale[i] * Pango.SCALE))
-                        pl.set_font_description(self._fd)
-                        w = pl.get_size()[0] / Pango.SCALE
-                        j -= 1
-            if self._x_pos[i] is not None:
-                x = int(self.rect[0] + self._x_pos[i])
-            elif self._horiz_align[i] == "center":
+                    pl, w, h = self._sprites.get_layout(
+                        cr, text, self._font, size, my_width)
+            if x_pos is not None:
+                x = int(self.rect[0] + x_pos)
+            elif horiz_align == "center":
                 x = int(self.rect[0] + self._margins[0] + (my_width - w) / 2)
-            elif self._horiz_align[i] == 'left':
+            elif horiz_align == 'left':
                 x = int(self.rect[0] + self._margins[0])
             else: # right
                 x = int(self.rect[0] + self.rect[2] - w - self._margins[2])
-            h = pl.get_size()[1] / Pango.SCALE
-            if self._y_pos[i] is not None:
-                y = int(self.rect[1] + self._y_pos[i])
-            elif self._vert_align[i] == "middle":
+            if y_pos is not None:
+                y = int(self.rect[1] + y_pos)
+            elif vert_align == "middle":
                 y = int(self.rect[1] + self._margins[1] + (my_height - h) / 2)
-            elif self._vert_align[i] == "top":
+            elif vert_align == "top":
                 y = int(self.rect[1] + self._margins[1])
             else: # bottom
                 y = int(self.rect[1] + self.rect[3] - h - self._margins[3])
             cr.save()
             cr.translate(x, y)
             cr.set_source_rgb(self._color[0], self._color[1], self._color[2])
-            PangoCairo.update_layout(cr, pl)
             PangoCairo.show_layout(cr, pl)
             cr.restore()
 
@@ -423,11 +941,9 @@ class Sprite:
             cr = self._sprites.cr
         max = 0
         for i in range(len(self.labels)):
-            pl = PangoCairo.create_layout(cr)
-            pl.set_text(str(self.labels[i]), -1)
-            self._fd.set_size(int(self._scale[i] * Pango.SCALE))
-            pl.set_font_description(self._fd)
-            w = pl.get_size()[0] / Pango.SCALE
+            pl, w, h = self._sprites.get_layout(
+                cr, str(self.labels[i]), self._font,
+                int(self._label_attrs[i][0] * Pango.SCALE))
             if w > max:
                 max = w
         return max
@@ -445,21 +961,34 @@ class Sprite:
         return(self._margins[0], self._margins[1])
 
     def get_pixel(self, pos, i=0):
-        ''' Return the pixl at (x, y) '''
-        x, y = pos
-        x = x - self.rect[0]
-        y = y - self.rect[1]
-        if y > self.images[i].get_height() - 1:
+        ''' Return the (r, g, b, a) of the pixel at (x, y), or (-1, -1, -1,
+        -1) if there is none. The pixels are read in place. '''
+        image = self.images[i]
+        x = int(pos[0]) - self.rect[0] - self._offsets[i][0]
+        y = int(pos[1]) - self.rect[1] - self._offsets[i][1]
+        if isinstance(image, ScaledImage):
+            x = int(x * image.image.get_width() / image.width)
+            y = int(y * image.image.get_height() / image.height)
+            image = image.image
+        if x < 0 or y < 0 or x >= image.get_width() or \
+           y >= image.get_height():
             return(-1, -1, -1, -1)
-        try:
-            array = self.images[i].get_pixels()
-            if array is not None:
-                offset = (y * self.images[i].get_width() + x) * 4
-                r, g, b, a = ord(array[offset]), ord(array[offset + 1]),\
-                             ord(array[offset + 2]), ord(array[offset + 3])
-                return(r, g, b, a)
-            else:
-                return(-1, -1, -1, -1)
-        except IndexError:
-            print("Index Error: %d %d" % (len(array), offset))
+        if isinstance(image, GdkPixbuf.Pixbuf):
+            # The surface converted from it (once, when it was set) holds
+            # the same pixels and can be read in place.
+            image = self._sprites.surface_from_pixbuf(image)
+        source = _surface_data(image)
+        if source is None:
+            return(-1, -1, -1, -1)
+        data, stride, x0, y0, fmt = source
+        offset = (y0 + y) * stride + (x0 + x) * 4
+        r, g, b, a = [data[offset + j] for j in _ARGB32]
+        if fmt == cairo.FORMAT_RGB24:
+            return(r, g, b, 255)
+        if fmt != cairo.FORMAT_ARGB32:
             return(-1, -1, -1, -1)
+        if a == 0:
+            return(0, 0, 0, 0)
+        if a < 255:  # cairo stores colours premultiplied by alpha
+            r, g, b = [(c * 255 + a // 2) // a for c in (r, g, b)]
+        return(r, g, b, a)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#Copyright (c) 2026 agent
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+'''
+
+worksheet.py renders Napier's-bones practice worksheets to PNG or PDF
+files without a display. Each page shows the index bone and the bones
+for one number, followed by one multiplication question per factor.
+
+Pages are rendered by a pool of worker processes and each one is
+written to disk as soon as it is done, so large batches scale with the
+number of cores and never have to fit in memory.
+
+Example usage:
+        # One page each for 437 and 1234, asking for 3x and 7x
+        ./worksheet.py --numbers 437 1234 --factors 3 7 -o sheets
+
+        # A page for every number from 100 to 999, with answers, as PDF
+        ./worksheet.py --range 100 999 --answers --format pdf -o sheets
+
+'''
+
+import os
+import sys
+import argparse
+from multiprocessing import Pool
+
+import cairo
+import gi
+gi.require_version('Gdk', '3.0')
+from gi.repository import Gdk, Pango, PangoCairo
+
+from bone_renderer import BONE_WIDTH, BONE_HEIGHT, draw_bone, \
+    load_svg_from_file
+from napier import products, to_string
+
+# A4, in points
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 36
+BONES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bones')
+# The bones of longer numbers would be less than a point wide.
+MAX_DIGITS = PAGE_WIDTH - 2 * MARGIN - 1
+
+_index_bones = {}  # (width, height) -> pixbuf, per worker process
+
+
+def _show_text(cr, text, x, y, size, bold=False):
+    ''' Draw a line of text with its top-left corner at (x, y) '''
+    pl = PangoCairo.create_layout(cr)
+    fd = Pango.FontDescription('Sans Bold' if bold else 'Sans')
+    fd.set_absolute_size(size * Pango.SCALE)
+    pl.set_font_description(fd)
+    pl.set_text(text, -1)
+    cr.move_to(x, y)
+    PangoCairo.show_layout(cr, pl)
+
+
+def _draw_page(cr, number, factors, answers):
+    ''' Draw one worksheet: the bones for number, then the questions '''
+    cr.set_source_rgb(1, 1, 1)
+    cr.paint()
+    cr.set_source_rgb(0, 0, 0)
+    _show_text(cr, "Napier's bones: %s" % (number), MARGIN, MARGIN, 18,
+               bold=True)
+
+    # The index bone and one bone per digit, as large as will fit in the
+    # top two thirds of the page.
+    top = MARGIN + 36
+    n = len(number) + 1
+    scale = min((PAGE_WIDTH - 2 * MARGIN) / (n * BONE_WIDTH),
+                (PAGE_HEIGHT * 2 / 3 - top) / BONE_HEIGHT)
+    width = int(BONE_WIDTH * scale)
+    height = int(BONE_HEIGHT * scale)
+    # The index bone comes from its SVG; render it at 4x for print.
+    if (width, height) not in _index_bones:
+        _index_bones[(width, height)] = load_svg_from_file(
+            os.path.join(BONES_PATH, 'bones-index.svg'), width * 4, height * 4)
+    index = _index_bones[(width, height)]
+    cr.save()
+    cr.translate(MARGIN, top)
+    cr.scale(0.25, 0.25)
+    Gdk.cairo_set_source_pixbuf(cr, index, 0, 0)
+    cr.paint()
+    cr.restore()
+    for i, digit in enumerate(number):
+        cr.save()
+        cr.translate(MARGIN + (i + 1) * BONE_WIDTH * scale, top)
+        draw_bone(cr, int(digit), scale=scale)
+        cr.restore()
+
+    # The questions, in two columns
+    y = top + height + 24
+    if answers:
+        table = products(bytearray([int(d) for d in number]), factors)
+    for i, factor in enumerate(factors):
+        x = MARGIN + (i % 2) * (PAGE_WIDTH - 2 * MARGIN) / 2
+        if answers:
+            text = '%d × %s = %s' % (factor, number, to_string(table[i]))
+        else:
+            text = '%d × %s = ____________' % (factor, number)
+        _show_text(cr, text, x, y + int(i / 2) * 28, 14)
+
+
+def render_page(task):
+    ''' Worker: render one page and write it to disk; return its path '''
+    number, factors, answers, fmt, path, dpi = task
+    if fmt == 'pdf':
+        surface = cairo.PDFSurface(path, PAGE_WIDTH, PAGE_HEIGHT)
+        cr = cairo.Context(surface)
+    else:
+        zoom = dpi / 72.
+        surface = cairo.ImageSurface(cairo.FORMAT_RGB24,
+                                     int(PAGE_WIDTH * zoom),
+                                     int(PAGE_HEIGHT * zoom))
+        cr = cairo.Context(surface)
+        cr.scale(zoom, zoom)
+    _draw_page(cr, number, factors, answers)
+    if fmt == 'pdf':
+        surface.finish()
+    else:
+        surface.write_to_png(path)
+    return path
+
+
+def _tasks(numbers, args):
+    ''' Generate one task per page, lazily '''
+    for number in numbers:
+        path = os.path.join(args.output, 'napier-%s.%s' % (number,
+                                                            args.format))
+        yield (number, args.factors, args.answers, args.format, path,
+               args.dpi)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Render Napier's bones worksheets to PNG or PDF.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--numbers', nargs='+', metavar='N',
+                       help='the numbers to make worksheets for')
+    group.add_argument('--range', nargs=2, type=int, metavar=('FIRST', 'LAST'),
+                       help='make worksheets for FIRST to LAST, inclusive')
+    parser.add_argument('--factors', nargs='+', type=int,
+                        default=list(range(2, 10)), metavar='F',
+                        help='the factors to ask for (default: 2 to 9)')
+    parser.add_argument('--answers', action='store_true',
+                        help='fill in the answers')
+    parser.add_argument('--format', choices=('png', 'pdf'), default='png')
+    parser.add_argument('--dpi', type=int, default=150,
+                        help='resolution of PNG pages (default: 150)')
+    parser.add_argument('-o', '--output', default='.',
+                        help='the directory to write the pages to')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='number of worker processes (default: all cores)')
+    args = parser.parse_args(argv)
+
+    if args.numbers is not None:
+        for number in args.numbers:
+            # Not isdigit(), which accepts the likes of '²'
+            if number == '' or not all('0' <= c <= '9' for c in number):
+                parser.error('not a whole number: %s' % (number))
+            if len(number) > MAX_DIGITS:
+                parser.error('numbers can have at most %d digits' %
+                             (MAX_DIGITS))
+        numbers = args.numbers
+    else:
+        if args.range[0] < 0 or args.range[1] < 0:
+            parser.error('the range must not be negative')
+        if len(str(args.range[1])) > MAX_DIGITS:
+            parser.error('numbers can have at most %d digits' % (MAX_DIGITS))
+        numbers = (str(n) for n in range(args.range[0], args.range[1] + 1))
+    if args.jobs is not None and args.jobs < 1:  # None: all cores
+        parser.error('--jobs must be at least 1')
+    for factor in args.factors:
+        if factor < 1 or factor > 9:
+            parser.error('factors must be between 1 and 9')
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+
+    count = 0
+    with Pool(args.jobs) as pool:
+        for path in pool.imap_unordered(render_page, _tasks(numbers, args),
+                                        chunksize=8):
+            count += 1
+            if count % 100 == 0:
+                print('%d pages written' % (count))
+    print('%d pages written to %s' % (count, args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())